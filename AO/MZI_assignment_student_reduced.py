@@ -31,7 +31,8 @@ y = np.linspace(-L/2,L/2, grid_size)
 X, Y = np.meshgrid(x,y)
 
 # --- Function: Compute Classical Interference ---
-def compute_classical_intensity(z2):
+def compute_classical_intensity_direct(z2):
+    """Field sum form of the intensity (complex128, recomputes everything), kept as the reference of IntensityEngine."""
     # Compute optical path lengths
     R1 = np.sqrt(X**2 + Y**2 + z1**2) # TODO 
     R2 = np.sqrt(X**2 + Y**2 + z2**2)# TODO
@@ -47,6 +48,105 @@ def compute_classical_intensity(z2):
     I = c*epsilon_0/2 * np.pow(abs(E_total),2) # TODO
     return I # TODO
 
+class IntensityEngine:
+    """
+    Cached float32 evaluation of the classical intensity.
+
+    |E1 + E2|^2 = 1/R1^2 + 1/R2^2 + 2 cos(k (R2 - R1)) / (R1 R2), so E1 only enters through R1 and
+    everything that does not depend on z2 (R1^2 = rho^2 + z1^2, R1, 1/R1^2, 2/R1) is computed once.
+    The phases k R1 and k R2 are about 2.5e7 rad, far beyond float32, so the path difference is
+    taken from the cancellation-free identity
+        R2 - R1 = (z2^2 - z1^2) / (R1 + R2),  z2^2 - z1^2 = (z2 - z1)(z2 + z1) (float64 scalar)
+    and only k (R2 - R1) (tens of rad on the slider range) is evaluated in float32. A map then
+    costs a few in-place float32 passes over two scratch buffers.
+    The float32 phase error is about phase * 6e-8 rad, so path differences whose central phase
+    exceeds max_float32_phase get their cosine term in float64 (from lazily cached float64 R1).
+    The scratch buffers are shared by every call, so an engine must not be used from two threads
+    at once (give each thread its own engine).
+    """
+    max_float32_phase = 1e3  # rad
+
+    def __init__(self, X, Y, z1, k):
+        self.shape = X.shape
+        self.z1 = float(z1)
+        self.k = float(k)
+        self._R1_sq_64 = X.astype(np.float64)**2 + Y**2 + self.z1**2
+        self._R1_64 = None
+        self.R1_sq = self._R1_sq_64.astype(np.float32)
+        self.R1 = np.sqrt(self.R1_sq)
+        self.inv_R1_sq = 1 / self.R1_sq
+        self.two_inv_R1 = 2 / self.R1
+        self.scale = np.float32(c*epsilon_0/2)
+        self._scratch = np.empty((2,) + self.shape, dtype=np.float32)
+
+    def __call__(self, z2, out=None):
+        """
+        Intensity map of one z2.
+
+        Args:
+            z2: Position of the second source
+            out: Optional float32 array of the grid shape to write the map into
+
+        Returns:
+            np.ndarray: Intensity map (float32)
+        """
+        if out is None:
+            out = np.empty(self.shape, dtype=np.float32)
+        R2, term = self._scratch
+        d = (z2 - self.z1) * (z2 + self.z1)  # z2^2 - z1^2 without cancellation
+
+        np.add(self.R1_sq, np.float32(d), out=R2)
+        np.sqrt(R2, out=R2)
+        # cos(k (R2 - R1)) with R2 - R1 = d / (R1 + R2), R1 + R2 >= z1 + z2 at the center
+        if abs(self.k * d) / (self.z1 + z2) <= self.max_float32_phase:
+            np.add(self.R1, R2, out=term)
+            np.divide(np.float32(self.k * d), term, out=term)
+            np.cos(term, out=term)
+        else:
+            if self._R1_64 is None:
+                self._R1_64 = np.sqrt(self._R1_sq_64)
+            term[...] = np.cos(self.k * d / (self._R1_64 + np.sqrt(self._R1_sq_64 + d)))
+        # 2 cos / (R1 R2) + 1/R2^2 + 1/R1^2
+        np.reciprocal(R2, out=R2)
+        term *= R2
+        term *= self.two_inv_R1
+        np.square(R2, out=R2)
+        np.add(R2, term, out=out)
+        out += self.inv_R1_sq
+        # Dark fringes can round below zero in float32
+        np.maximum(out, 0, out=out)
+        out *= self.scale
+        return out
+
+    def stack(self, z2_values, out=None):
+        """
+        Intensity maps of a whole z2 axis.
+
+        Args:
+            z2_values: 1D array of z2 positions
+            out: Optional float32 array of shape (len(z2_values),) + grid shape
+
+        Returns:
+            np.ndarray: Stack of intensity maps (float32), one per z2
+        """
+        z2_values = np.asarray(z2_values, dtype=np.float64).ravel()
+        if out is None:
+            out = np.empty((len(z2_values),) + self.shape, dtype=np.float32)
+        for i, z2 in enumerate(z2_values):
+            self(z2, out=out[i])
+        return out
+
+intensity_engine = IntensityEngine(X, Y, z1, k)
+
+def compute_classical_intensity(z2):
+    """
+    Classical intensity map (float32) of the second source at z2, or a stack of maps if z2 is an array.
+    See IntensityEngine (compute_classical_intensity_direct is the unoptimized field sum).
+    """
+    if np.ndim(z2) == 0:
+        return intensity_engine(z2)
+    return intensity_engine.stack(z2)
+
 # --- Function: Simulate Photon Detection ---
 # def simulate_quantum_hits(z2, num_photons):
 #     num_photons = int(num_photons)
@@ -78,64 +178,208 @@ def compute_classical_intensity(z2):
 
 #     return hit_map
 
-import psutil
 import time
-from joblib import Parallel, delayed, cpu_count
-
-def _sample_photons(I_flat, num_photons):
-    indices = np.random.choice(I_flat.size, size=num_photons, p=I_flat)
-    return np.bincount(indices, minlength=I_flat.size)
-
-def estimate_safe_batch_size(target_memory_gb=2.0, photons_per_mb=1_000_000):
-    """Estimate a safe batch size based on available memory (default: use 2GB)."""
-    mem = psutil.virtual_memory()
-    available_gb = mem.available / (1024 ** 3)
-    safe_gb = min(target_memory_gb, available_gb)  # Be conservative
-    batch_size = int(safe_gb * 1024 * 1024 / (4))  # Estimate: 4 bytes per photon (float32/uint32)
-    return max(batch_size, photons_per_mb * 10)  # Ensure at least 2.5M photons
-
-def simulate_quantum_hits_parallel(z2, total_photons, n_jobs=-1, target_memory_gb=32.0):
+import atexit
+import queue
+import threading
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from joblib import cpu_count
+
+# Fixed number of pixel blocks of the sampler, so that a seed gives the same map for any n_jobs
+n_sampling_blocks = 64
+
+def _sample_photons(p_block, num_photons, seed):
+    """
+    Hit counts of num_photons photons over the pixels of one block.
+
+    Args:
+        p_block: Probabilities of the pixels of the block (normalized to the block)
+        num_photons: Number of photons landing in the block
+        seed: SeedSequence of the block (independent Generator stream)
+
+    Returns:
+        np.ndarray: Hit count of every pixel of the block (int64)
+    """
+    rng = np.random.default_rng(seed)
+    return rng.multinomial(num_photons, p_block)
+
+# Shared arrays of a sampler pool worker process (set by _attach_worker, unused in the main process)
+_worker = {}
+
+def _attach_worker(prob_name, counts_name, size):
+    """Pool initializer: map the shared probability grid and count buffer (also run by respawned workers)."""
+    prob_shm = shared_memory.SharedMemory(name=prob_name)
+    counts_shm = shared_memory.SharedMemory(name=counts_name)
+    _worker['shm'] = (prob_shm, counts_shm)  # Keep the mappings alive
+    _worker['prob'] = np.ndarray(size, dtype=np.float64, buffer=prob_shm.buf)
+    _worker['counts'] = np.ndarray(size, dtype=np.int64, buffer=counts_shm.buf)
+
+def _sample_into(prob, counts, start, stop, num_photons, seed):
+    """Write the hits of one pixel block into its slice of counts."""
+    p_block = prob[start:stop]
+    counts[start:stop] = _sample_photons(p_block / p_block.sum(), num_photons, seed)
+
+def _sample_block(start, stop, num_photons, seed):
+    """Worker task: _sample_into on the shared arrays of the worker process."""
+    _sample_into(_worker['prob'], _worker['counts'], start, stop, num_photons, seed)
+
+class PhotonSampler:
+    """
+    Long-lived photon sampler: a process pool sharing the probability grid and the count buffer
+    through shared memory.
+
+    The grid is written once per z2 (set_z2), a sample() only sends (block, photons, seed) to the
+    workers and every task writes its block's disjoint slice of the count buffer, so there is no
+    reduction and no worker identity to keep. Nothing of the grid size is pickled.
+    The mapped grid and the count buffer belong to the sampler, so one sampler serves one thread.
+    If a worker dies, the pool raises instead of hanging, and the sample restarts the pool and
+    reruns its tasks once (rewriting a block's slice is idempotent).
+        usage:
+            with PhotonSampler() as sampler:
+                sampler.set_z2(z2)
+                hit_counts = sampler.sample(1e9, seed=0)
+    """
+    def __init__(self, shape=X.shape, n_jobs=-1):
+        self.shape = shape
+        self.size = int(np.prod(shape))
+        self.n_workers = cpu_count() if n_jobs == -1 else n_jobs
+        self.bounds = np.linspace(0, self.size, n_sampling_blocks + 1).astype(np.int64)
+        self.block_p = None
+        self.z2 = None
+
+        self._prob_shm = shared_memory.SharedMemory(create=True, size=self.size * 8)
+        self._counts_shm = shared_memory.SharedMemory(create=True, size=self.size * 8)
+        self.prob = np.ndarray(self.size, dtype=np.float64, buffer=self._prob_shm.buf)
+        self.counts = np.ndarray(self.size, dtype=np.int64, buffer=self._counts_shm.buf)
+
+        # One worker runs in this process, without a pool
+        self._pool = None
+        if self.n_workers > 1:
+            self._start_pool()
+
+    def _start_pool(self):
+        self._pool = ProcessPoolExecutor(self.n_workers, initializer=_attach_worker,
+                                         initargs=(self._prob_shm.name, self._counts_shm.name, self.size))
+
+    def set_intensity(self, intensity):
+        """Write a new (unnormalized) intensity map into the shared probability grid."""
+        np.copyto(self.prob, intensity.ravel())
+        self.prob /= self.prob.sum()
+        self.block_p = np.add.reduceat(self.prob, self.bounds[:-1])
+        self.z2 = None
+
+    def set_z2(self, z2):
+        """
+        Map the classical intensity of z2 (skipped if it is already mapped).
+        This evaluates the shared intensity_engine, other threads map their own engine's maps with set_intensity.
+        """
+        if self.z2 != z2:
+            self.set_intensity(compute_classical_intensity(z2))
+            self.z2 = z2
+
+    def sample(self, total_photons, seed=None):
+        """
+        Hit counts of total_photons photons over the mapped grid (see simulate_quantum_hits_parallel).
+        seed may be an int, None or a SeedSequence.
+
+        Returns:
+            np.ndarray: Hit count of every pixel (int64, grid shape)
+        """
+        if self.block_p is None:
+            raise RuntimeError("No intensity mapped, call set_z2 or set_intensity first")
+        seed_seq = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+        block_seeds = seed_seq.spawn(n_sampling_blocks)
+        block_photons = np.random.default_rng(seed_seq).multinomial(int(total_photons), self.block_p / self.block_p.sum())
+
+        tasks = [(int(self.bounds[i]), int(self.bounds[i + 1]), n, block_seeds[i])
+                 for i, n in enumerate(block_photons) if n > 0]
+        # Blocks without photons keep zero counts
+        self.counts.fill(0)
+        if self._pool is None:
+            for task in tasks:
+                _sample_into(self.prob, self.counts, *task)
+        elif tasks:
+            chunksize = max(1, len(tasks) // (4 * self.n_workers))
+            try:
+                list(self._pool.map(_sample_block, *zip(*tasks), chunksize=chunksize))
+            except BrokenProcessPool:
+                # A worker died: start a fresh pool and rerun every task (a second failure raises)
+                self._pool.shutdown(cancel_futures=True)
+                self._start_pool()
+                list(self._pool.map(_sample_block, *zip(*tasks), chunksize=chunksize))
+        return self.counts.reshape(self.shape).copy()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+        # Drop the views before releasing the buffers
+        self.prob = self.counts = None
+        for shm in (self._prob_shm, self._counts_shm):
+            shm.close()
+            shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# Sampler reused between calls (and slider moves) of simulate_quantum_hits_parallel
+_sampler = None
+
+def get_sampler(n_jobs=-1):
+    """Shared PhotonSampler, restarted only if the number of workers changes."""
+    global _sampler
+    n_workers = cpu_count() if n_jobs == -1 else n_jobs
+    if _sampler is None or _sampler.n_workers != n_workers:
+        if _sampler is not None:
+            _sampler.close()
+        _sampler = PhotonSampler(n_jobs=n_workers)
+    return _sampler
+
+@atexit.register
+def _close_sampler():
+    if _sampler is not None:
+        _sampler.close()
+
+def simulate_quantum_hits_parallel(z2, total_photons, n_jobs=-1, target_memory_gb=None, seed=None, sampler=None):
+    """
+    Simulate the detection of total_photons photons and return the normalized hit map.
+
+    The hit counts are drawn directly instead of drawing every photon: the photons are first split
+    between n_sampling_blocks pixel blocks with one multinomial draw over the block probabilities,
+    then every block draws its pixel counts with a multinomial conditioned on its total, with its own
+    Generator stream. This is an exact multinomial sample of the whole grid, memory is O(grid) and
+    the runtime hardly depends on the number of photons (1e12 photons take about as long as 1e3).
+    The blocks run on a persistent PhotonSampler pool, started on the first call.
+
+    Args:
+        z2: Position of the second source
+        total_photons: Number of detected photons
+        n_jobs: Number of worker processes (-1: all cores)
+        target_memory_gb: Deprecated and ignored, the sampler no longer batches the photons
+        seed: Seed of the sampler (None: fresh entropy), the map only depends on the seed
+        sampler: PhotonSampler to use (default: the shared one of get_sampler(n_jobs))
+
+    Returns:
+        np.ndarray: Hit map normalized to its maximum
+    """
+    if target_memory_gb is not None:
+        warnings.warn("target_memory_gb is ignored: the memory of the sampler is O(grid), not O(photons)",
+                      DeprecationWarning, stacklevel=2)
     total_photons = int(total_photons)
-    I_classical = compute_classical_intensity(z2).astype(np.float32)
-    prob_dist = I_classical / I_classical.sum()
-    I_flat = prob_dist.ravel()
-    shape = prob_dist.shape
-
-    n_cores = cpu_count() if n_jobs == -1 else n_jobs
-    batch_size = estimate_safe_batch_size(target_memory_gb=target_memory_gb)
-
-    print(f"💡 Using {n_cores} CPU cores")
-    print(f"📦 Estimated safe batch size: {batch_size:,} photons")
-    print(f"🔄 Total batches: {total_photons // batch_size + (total_photons % batch_size > 0)}")
-
-    hit_counts = np.zeros(I_flat.size, dtype=np.int64)
+    sampler = sampler or get_sampler(n_jobs)
+    print(f"💡 Using {sampler.n_workers} CPU cores for {total_photons:,} photons")
     start_time = time.time()
 
-    num_batches = total_photons // batch_size
-    remainder = total_photons % batch_size
-    all_batch_sizes = [batch_size] * num_batches
-    if remainder > 0:
-        all_batch_sizes.append(remainder)
-
-    for i, batch_photons in enumerate(all_batch_sizes, start=1):
-        photons_per_core = [batch_photons // n_cores] * n_cores
-        for j in range(batch_photons % n_cores):
-            photons_per_core[j] += 1
-
-        print(f"🧪 Batch {i}/{len(all_batch_sizes)}: Simulating {batch_photons:,} photons...")
-        batch_start = time.time()
-
-        results = Parallel(n_jobs=n_cores)(
-            delayed(_sample_photons)(I_flat, n) for n in photons_per_core
-        )
-
-        hit_counts += np.sum(results, axis=0)
-        batch_time = time.time() - batch_start
-        mem_used = psutil.virtual_memory().used / (1024 ** 3)
-        print(f"✅ Batch {i} completed in {batch_time:.2f}s | Memory used: {mem_used:.2f} GB")
+    sampler.set_z2(z2)
+    hit_map = sampler.sample(total_photons, seed)
 
     total_time = time.time() - start_time
-    hit_map = hit_counts.reshape(shape)
     if hit_map.max() > 0:
         hit_map = hit_map / hit_map.max()
 
@@ -144,10 +388,255 @@ def simulate_quantum_hits_parallel(z2, total_photons, n_jobs=-1, target_memory_g
 
 
 
+class ProgressiveRenderer:
+    """
+    Background compute mode of the slider figure.
+
+    request() only records the latest (z2, photons) and returns at once. A worker thread computes
+    the classical map, then draws the photons in growing chunks (first_chunk, then growth times the
+    photons so far, ...) on a PhotonSampler and pushes the accumulated hit map after every chunk, so
+    a coarse map shows up immediately and sharpens as photons land. Every request bumps a generation
+    counter, and the worker drops a job between chunks as soon as a newer one arrives, so slider drags
+    never queue stale simulations. The results are applied on the GUI thread by a canvas timer
+    (start), which calls on_classical(I) and on_hits(hit_map, photons_done) for the current generation.
+    The worker thread has its own IntensityEngine and (unless one is given) its own PhotonSampler, so
+    the main thread can keep using compute_classical_intensity and get_sampler meanwhile.
+    """
+    def __init__(self, on_classical, on_hits, sampler=None, first_chunk=10_000, growth=10, seed=None):
+        self.on_classical = on_classical
+        self.on_hits = on_hits
+        self.engine = IntensityEngine(X, Y, z1, k)
+        self._own_sampler = sampler is None
+        self.sampler = sampler or PhotonSampler()
+        self.first_chunk = int(first_chunk)
+        self.growth = growth
+        self.seed_seq = np.random.SeedSequence(seed)
+        self.generation = 0
+        self._job = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._results = queue.Queue()
+        self._timer = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def request(self, z2, photons):
+        """Replace any pending or running job by the map of (z2, photons)."""
+        with self._lock:
+            self.generation += 1
+            self._job = (self.generation, z2, int(photons))
+        self._wakeup.set()
+
+    def _stale(self, generation):
+        return self._closed or generation != self.generation
+
+    def _run(self):
+        while not self._closed:
+            self._wakeup.wait()
+            with self._lock:
+                job, self._job = self._job, None
+                self._wakeup.clear()
+            if job is None:
+                continue
+            generation, z2, photons = job
+            I = self.engine(z2)
+            self._results.put(('classical', generation, I, None))
+
+            # Coarse to fine: sums of independent multinomials are a multinomial of the total
+            self.sampler.set_intensity(I)
+            hit_counts = np.zeros(self.sampler.shape, dtype=np.int64)
+            done = 0
+            while done < photons and not self._stale(generation):
+                chunk = min(max(self.first_chunk, int(done * (self.growth - 1))), photons - done)
+                hit_counts += self.sampler.sample(chunk, self.seed_seq.spawn(1)[0])
+                done += chunk
+                if not self._stale(generation):
+                    self._results.put(('hits', generation, hit_counts / max(hit_counts.max(), 1), done))
+
+    def poll(self):
+        """
+        Apply the newest results of the current generation (call from the GUI thread).
+
+        Returns:
+            bool: True if anything was updated
+        """
+        latest = {}
+        while True:
+            try:
+                kind, generation, data, photons = self._results.get_nowait()
+            except queue.Empty:
+                break
+            if generation == self.generation:
+                latest[kind] = (data, photons)
+        if 'classical' in latest:
+            self.on_classical(latest['classical'][0])
+        if 'hits' in latest:
+            self.on_hits(*latest['hits'])
+        return bool(latest)
+
+    def start(self, fig, interval_ms=50):
+        """Poll from a timer of the figure's canvas and redraw when something changed."""
+        def update():
+            if self.poll():
+                fig.canvas.draw_idle()
+        self._timer = fig.canvas.new_timer(interval=interval_ms)
+        self._timer.add_callback(update)
+        self._timer.start()
+
+    def close(self):
+        self._closed = True
+        self._wakeup.set()
+        if self._timer is not None:
+            self._timer.stop()
+        self._thread.join()
+        if self._own_sampler:
+            self.sampler.close()
+
+
+
+# --- Path Difference Sweep ---
+class RadialProfile:
+    """
+    Mean of maps over rings of one pixel pitch around the optical axis (inside the inscribed circle),
+    for whole chunks of maps. With an envelope map (e.g. the 1/R^2 falloff of the sources), the
+    profiles are divided by its profile so that fringes keep the same scale across the screen.
+    """
+    def __init__(self, X, Y, envelope=None):
+        rho = np.hypot(X, Y).ravel()
+        pitch = abs(X[0, 1] - X[0, 0])
+        inside = np.flatnonzero(rho <= min(abs(X).max(), abs(Y).max()))
+        bins = (rho[inside] / pitch).astype(np.int64)
+        order = np.argsort(bins, kind='stable')
+        self.pixels = inside[order]
+        self.starts = np.flatnonzero(np.r_[True, np.diff(bins[order]) > 0])
+        self.counts = np.diff(np.r_[self.starts, len(self.pixels)])
+        self.envelope = None
+        if envelope is not None:
+            self.envelope = self(envelope[None])[0]
+
+    def __call__(self, maps):
+        """(n, H, W) maps -> (n, n_rings) radial profiles (float64)"""
+        flat = maps.reshape(len(maps), -1)[:, self.pixels]
+        profiles = np.add.reduceat(flat, self.starts, axis=1, dtype=np.float64) / self.counts
+        if self.envelope is not None:
+            profiles /= self.envelope
+        return profiles
+
+def count_rings(profiles, hysteresis=0.25):
+    """
+    Bright rings of radial profiles: rises from below mid - h to above mid + h (h = hysteresis times
+    the half range), plus the central spot when it starts bright. The hysteresis keeps the shot noise
+    of photon maps from counting as rings.
+    """
+    p_max, p_min = profiles.max(axis=1), profiles.min(axis=1)
+    mid, h = (p_max + p_min) / 2, hysteresis * (p_max - p_min) / 2
+    bright = profiles[:, 0] >= mid
+    rings = bright.astype(np.int32)
+    for column in profiles.T[1:]:
+        rises = ~bright & (column > mid + h)
+        rings += rises
+        bright = (bright & ~(column < mid - h)) | rises
+    return rings
+
+def map_metrics(maps, profile):
+    """
+    Summary metrics of a chunk of maps.
+
+    Returns:
+        dict: 'visibility' (Imax - Imin) / (Imax + Imin) of the (envelope corrected) radial profile, 'contrast' (RMS contrast
+        std / mean over the map), 'ring_count' (bright rings of the radial profile, see count_rings)
+        and 'mean_intensity'
+    """
+    flat = maps.reshape(len(maps), -1)
+    mean = flat.mean(axis=1, dtype=np.float64)
+    std = flat.std(axis=1, dtype=np.float64)
+    p = profile(maps)
+    p_max, p_min = p.max(axis=1), p.min(axis=1)
+    return {
+        'visibility': np.divide(p_max - p_min, p_max + p_min, out=np.zeros_like(p_max), where=p_max + p_min > 0),
+        'contrast': np.divide(std, mean, out=np.zeros_like(mean), where=mean > 0),
+        'ring_count': count_rings(p),
+        'mean_intensity': mean,
+    }
+
+def sweep_path_difference(z2_values, photons=None, output="mzi_sweep.npz", max_memory_mb=256, seed=None, sampler=None):
+    """
+    Fringe metrics (see map_metrics) over a whole z2 range.
+
+    The maps are evaluated in chunks (IntensityEngine.stack) sized to max_memory_mb and reduced to
+    their metrics right away, so the full maps are never kept. The sweep uses its own engine and
+    sampler, so it can run while the progressive renderer (or another thread) is busy.
+
+    Args:
+        z2_values: 1D array of z2 positions (e.g. z1 + np.linspace(0, 5e-6, 2000))
+        photons: Also sample this many photons per z2 and compute the metrics of the hit maps
+                 ('photon_visibility', 'photon_contrast', 'photon_ring_count'), None to skip
+        output: Compressed .npz file of the results (None to skip writing it)
+        max_memory_mb: Memory budget of a chunk of maps
+        seed: Seed of the photon sampling (one independent stream per z2)
+        sampler: PhotonSampler of the photon sampling, not used by any other thread meanwhile
+                 (default: a dedicated one, closed at the end of the sweep)
+
+    Returns:
+        dict: 'z2', 'path_difference' (z2 - z1) and one array per metric
+    """
+    z2_values = np.asarray(z2_values, dtype=np.float64).ravel()
+    engine = IntensityEngine(X, Y, z1, k)
+    profile = RadialProfile(X, Y, envelope=engine.inv_R1_sq)
+    # Chunk maps + their reordered copy for the profile (+ the chunk of hit maps in photon mode)
+    map_bytes = engine.R1.nbytes
+    maps_per_z2 = 3 if photons is None else 4
+    chunk_size = max(1, int(max_memory_mb * 2**20 // (maps_per_z2 * map_bytes)))
+    chunk = np.empty((min(chunk_size, len(z2_values)),) + engine.shape, dtype=np.float32)
+    hits_chunk = np.empty_like(chunk) if photons is not None else None
+
+    own_sampler = photons is not None and sampler is None
+    if photons is not None:
+        sampler = sampler or PhotonSampler()
+        seeds = np.random.SeedSequence(seed).spawn(len(z2_values))
+
+    results = {}
+    start_time = time.time()
+    try:
+        for start in range(0, len(z2_values), chunk_size):
+            z2_chunk = z2_values[start:start + chunk_size]
+            maps = engine.stack(z2_chunk, out=chunk[:len(z2_chunk)])
+            metrics = map_metrics(maps, profile)
+
+            if photons is not None:
+                hits = hits_chunk[:len(z2_chunk)]
+                for i, I in enumerate(maps):
+                    sampler.set_intensity(I)
+                    hits[i] = sampler.sample(photons, seeds[start + i])
+                metrics.update({f"photon_{name}": values for name, values in map_metrics(hits, profile).items()
+                                if name != 'mean_intensity'})
+
+            for name, values in metrics.items():
+                results.setdefault(name, []).append(values)
+            print(f"🔄 {start + len(z2_chunk):,}/{len(z2_values):,} maps ({time.time() - start_time:.1f}s)")
+    finally:
+        if own_sampler:
+            sampler.close()
+
+    results = {name: np.concatenate(values) for name, values in results.items()}
+    results['z2'] = z2_values
+    results['path_difference'] = z2_values - z1
+    if output is not None:
+        np.savez_compressed(output, **results, z1=z1, k=k, L=L, grid_size=grid_size,
+                            photons=-1 if photons is None else int(photons))
+        print(f"💾 Sweep saved to {output}")
+    return results
+
+
+
 # --- Initial Settings ---
 initial_z2_offset = 3e-6 # TODO (e.g., 1e-3)
 initial_photons = 1e9 # TODO (e.g., 1000)
 initial_z2 = z1 + initial_z2_offset
+progressive_rendering = True  # Compute the combined figure in the background (see ProgressiveRenderer)
+sweep_mode = False  # Also sweep the path difference and plot the fringe metrics (see sweep_path_difference)
+sweep_offsets = np.linspace(0, 5e-6, 2000)
 extent = (-L/2, L/2, -L/2, L/2)  # for mm scale
 
 # --- Classical Figure (pre-coded reward) ---
@@ -197,14 +686,18 @@ if __name__ == "__main__":
     fig3, (ax3a, ax3b) = plt.subplots(1, 2, figsize=(12, 6))
     plt.subplots_adjust(bottom=0.25)
     I_comb = compute_classical_intensity(initial_z2)
-    hits_comb = simulate_quantum_hits_parallel(initial_z2, initial_photons)
+    if progressive_rendering:
+        # Filled in by the renderer once the window is up
+        hits_comb = np.zeros_like(I_comb)
+    else:
+        hits_comb = simulate_quantum_hits_parallel(initial_z2, initial_photons)
 
     img3a = ax3a.imshow(I_comb, cmap='inferno', extent=extent)
     ax3a.set_title("Classical MZI (Combined)")
     ax3a.set_xlabel("x (mm)")
     ax3a.set_ylabel("y (mm)")
 
-    img3b = ax3b.imshow(hits_comb, cmap='viridis', extent=extent)
+    img3b = ax3b.imshow(hits_comb, cmap='viridis', extent=extent, vmin=0, vmax=1)
     ax3b.set_title("Quantum MZI (Combined)")
     ax3b.set_xlabel("x (mm)")
     ax3b.set_ylabel("y (mm)")
@@ -214,15 +707,39 @@ if __name__ == "__main__":
     slider4 = Slider(ax_slider4, 'Path Diff (mm)', 0, 5, valinit=initial_z2_offset * 1e-6)
     slider5 = Slider(ax_slider5, 'Photons', 100, 1e7, valinit=initial_photons, valstep=100)
 
-    def update_combined(val):
-        z2 = z1 + slider4.val * 1e-6
-        photons = int(slider5.val)
-        img3a.set_data(compute_classical_intensity(z2))
-        img3b.set_data(simulate_quantum_hits_parallel(z2, photons))
-        fig3.canvas.draw_idle()
+    if progressive_rendering:
+        def show_hits(hit_map, photons):
+            img3b.set_data(hit_map)
+            ax3b.set_title(f"Quantum MZI (Combined): {photons:,} photons")
+
+        renderer = ProgressiveRenderer(img3a.set_data, show_hits)
+        renderer.start(fig3)
+        renderer.request(initial_z2, initial_photons)
+
+        def update_combined(val):
+            renderer.request(z1 + slider4.val * 1e-6, int(slider5.val))
+    else:
+        def update_combined(val):
+            z2 = z1 + slider4.val * 1e-6
+            photons = int(slider5.val)
+            img3a.set_data(compute_classical_intensity(z2))
+            img3b.set_data(simulate_quantum_hits_parallel(z2, photons))
+            fig3.canvas.draw_idle()
 
     slider4.on_changed(update_combined)
     slider5.on_changed(update_combined)
 
+    # --- Path Difference Sweep (analysis mode) ---
+    if sweep_mode:
+        sweep = sweep_path_difference(z1 + sweep_offsets)
+        fig4, axes4 = plt.subplots(3, 1, figsize=(8, 8), sharex=True)
+        for ax, name in zip(axes4, ('visibility', 'contrast', 'ring_count')):
+            ax.plot(sweep['path_difference'], sweep[name])
+            ax.set_ylabel(name.replace('_', ' '))
+        axes4[-1].set_xlabel("Path difference z2 - z1")
+        fig4.suptitle("MZI fringe metrics vs path difference")
+
     # --- Show All Plots ---
     plt.show()
+    if progressive_rendering:
+        renderer.close()
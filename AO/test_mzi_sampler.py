@@ -0,0 +1,57 @@
+import time
+import matplotlib
+matplotlib.use('Agg')
+import numpy as np
+import MZI_assignment_student_reduced as mzi
+
+
+def make_renderer(seed=1):
+    # growth=2 splits a render into many chunks, so it overlaps several direct samples
+    return mzi.ProgressiveRenderer(lambda I: None, None, sampler=mzi.PhotonSampler(n_jobs=1),
+                                   first_chunk=1000, growth=2, seed=seed)
+
+
+def render(renderer, z2, photons, between_polls=lambda: time.sleep(0.001), timeout=120):
+    """Request one map and poll until all its photons landed, returns the final hit map."""
+    final = {}
+    renderer.on_hits = lambda hit_map, done: final.update(hit_map=hit_map, done=done)
+    renderer.request(z2, photons)
+    deadline = time.time() + timeout
+    while final.get('done') != photons:
+        assert time.time() < deadline, "render timed out"
+        between_polls()
+        renderer.poll()
+    return final['hit_map']
+
+
+def test_render_and_direct_sample_at_once():
+    # Both samplers run in-process (n_jobs=1), the path that used to share module state
+    z2_render, z2_direct, photons = 5e-4, 0.0, 10_000_000
+    n_seeds = 4
+
+    with mzi.PhotonSampler(n_jobs=1) as sampler:
+        sampler.set_z2(z2_direct)
+        expected_direct = [sampler.sample(photons, seed) for seed in range(n_seeds)]
+    reference = make_renderer()
+    try:
+        expected_render = render(reference, z2_render, photons)
+    finally:
+        reference.close()
+        reference.sampler.close()
+
+    renderer = make_renderer()
+    direct = mzi.PhotonSampler(n_jobs=1)
+    rounds = []
+    def direct_sample():
+        seed = len(rounds) % n_seeds
+        np.testing.assert_array_equal(direct.sample(photons, seed), expected_direct[seed])
+        rounds.append(seed)
+    try:
+        direct.set_z2(z2_direct)
+        hit_map = render(renderer, z2_render, photons, between_polls=direct_sample)
+        np.testing.assert_array_equal(hit_map, expected_render)
+        assert len(rounds) > 1  # The direct samples overlapped the render
+    finally:
+        renderer.close()
+        renderer.sampler.close()
+        direct.close()
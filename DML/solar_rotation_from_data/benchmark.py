@@ -0,0 +1,201 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime
+import numpy as np
+from scipy.spatial import cKDTree
+
+from utils.synthetic import SyntheticSun
+from utils.image_processing import detect_sunspots
+from utils.solar_geometry import pixels_to_heliographic
+from utils.feature_tracking import SunspotTracker
+from utils.data import track_association
+from utils.track_store import tracks_to_columns
+from utils.analysis import track_summaries, filter_summaries, fit_differential_rotation
+
+'''
+Benchmark suite of the solar rotation pipeline on synthetic frames (see utils/synthetic.py).
+For every scale (number of spots x number of frames) it times each stage and the end to end run:
+    detect: detect_sunspots on every JPEG (decode + detection)
+    geometry: pixels_to_heliographic on the detections of every frame
+    track: SunspotTracker.process_frame on every frame
+    stitch: track_association
+    analysis: track summaries, std filter and the differential rotation fit
+and checks the result against the ground truth (detection recall/precision/position error and the
+recovered rotation rate). Results are stored as JSON, and --compare prints the change against a
+previous run.
+    usage:
+        python benchmark.py --scales 20x48 50x120 100x240 --compare benchmark_results/<previous>.json
+'''
+
+STAGES = ('detect', 'geometry', 'track', 'stitch', 'analysis')
+START = datetime(2025, 4, 22)
+
+
+def run_scale(n_spots, n_frames, work_dir, repeat=1, seed=0, max_angular_speed=1, limb_cutoff=0.85):
+    """Benchmark one scale, the timings are the best of repeat runs"""
+    sun = SyntheticSun(n_spots, seed=seed)
+    file_paths, times, truths = sun.write(work_dir, START, n_frames)
+
+    best = {}
+    for _ in range(repeat):
+        timings = {}
+        t_start = time.perf_counter()
+
+        t0 = time.perf_counter()
+        detections = [detect_sunspots(path)[1:] for path in file_paths]
+        timings['detect'] = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        for frame_time, (centroids, solar_center, solar_radius) in zip(times, detections):
+            pixels_to_heliographic(np.asarray(centroids, dtype=float).reshape(-1, 2), frame_time, solar_center, solar_radius)
+        timings['geometry'] = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        _, solar_center, solar_radius = detections[0]
+        tracker = SunspotTracker(solar_center, solar_radius, max_angular_speed, limb_cutoff=limb_cutoff)
+        for frame_time, (centroids, _, _) in zip(times, detections):
+            tracker.process_frame(frame_time, centroids)
+        data = [t for t in tracker.tracks if len(t['velocities']) >= 1]
+        timings['track'] = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        stitched = track_association(data)
+        timings['stitch'] = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        summaries = filter_summaries(track_summaries(tracks_to_columns(stitched)))
+        params = None
+        if len(summaries['track_id']) >= 3:
+            params, _ = fit_differential_rotation(summaries['median_latitude'], summaries['mean_period'],
+                                                  summaries['mean_error'])
+        timings['analysis'] = time.perf_counter() - t0
+
+        #The geometry stage is also inside track, so end to end is the chain without it
+        timings['end_to_end'] = time.perf_counter() - t_start - timings['geometry']
+        best = {k: min(v, best.get(k, np.inf)) for k, v in timings.items()}
+
+    accuracy = detection_accuracy(detections, truths, limb_cutoff)
+    accuracy.update(rotation_accuracy(sun, params))
+    accuracy.update(n_tracks=len(data), n_stitched=len(stitched), n_fit_tracks=int(len(summaries['track_id'])))
+    return {
+        'n_spots': n_spots,
+        'n_frames': n_frames,
+        'timings_s': best,
+        'per_frame_ms': {k: 1000 * v / n_frames for k, v in best.items()},
+        'accuracy': accuracy,
+    }
+
+
+def detection_accuracy(detections, truths, limb_cutoff, max_distance_px=2.0):
+    """Recall and precision of the detections against the visible spots inside the limb cutoff"""
+    n_true = n_found = n_matched = 0
+    errors = []
+    for (centroids, solar_center, solar_radius), truth in zip(detections, truths):
+        true_xy = np.column_stack([truth['x'], truth['y']])
+        r = np.hypot(true_xy[:, 0] - solar_center[0], true_xy[:, 1] - solar_center[1]) / solar_radius
+        true_xy = true_xy[truth['visible'] & (r <= limb_cutoff)]
+        found = np.asarray(centroids, dtype=float).reshape(-1, 2)
+        r = np.hypot(found[:, 0] - solar_center[0], found[:, 1] - solar_center[1]) / solar_radius
+        found = found[r <= limb_cutoff]
+        n_true += len(true_xy)
+        n_found += len(found)
+        if len(true_xy) and len(found):
+            distance, _ = cKDTree(true_xy).query(found, distance_upper_bound=max_distance_px)
+            matched = np.isfinite(distance)
+            n_matched += int(matched.sum())
+            errors.extend(distance[matched])
+    return {
+        'recall': n_matched / n_true if n_true else None,
+        'precision': n_matched / n_found if n_found else None,
+        'position_rms_px': float(np.sqrt(np.mean(np.square(errors)))) if errors else None,
+    }
+
+
+def rotation_accuracy(sun, params, max_latitude=30):
+    """Fitted vs true coefficients and the worst rotation rate error for |latitude| <= max_latitude"""
+    result = {'true_ABC': list(sun.rotation), 'fitted_ABC': None, 'max_rate_error_deg_per_day': None}
+    if params is None:
+        return result
+    lat = np.linspace(-max_latitude, max_latitude, 61)
+    s2 = np.sin(np.radians(lat)) ** 2
+    fitted = params[0] + params[1] * s2 + params[2] * s2 ** 2
+    result['fitted_ABC'] = [float(p) for p in params]
+    result['max_rate_error_deg_per_day'] = float(np.max(np.abs(fitted - sun.omega(lat))))
+    return result
+
+
+def metadata():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': sys.version.split()[0],
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def compare(results, previous_path):
+    """Print the timing ratio (new / previous) of every stage of the scales both runs have"""
+    with open(previous_path, 'r') as f:
+        previous = {(r['n_spots'], r['n_frames']): r for r in json.load(f)['results']}
+    print(f"\nCompared with {previous_path} (new / previous time, < 1 is faster):")
+    for r in results:
+        old = previous.get((r['n_spots'], r['n_frames']))
+        if old is None:
+            continue
+        ratios = "  ".join(f"{k}={r['timings_s'][k] / old['timings_s'][k]:.2f}"
+                           for k in (*STAGES, 'end_to_end') if old['timings_s'].get(k))
+        print(f"{r['n_spots']} spots x {r['n_frames']} frames: {ratios}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Solar rotation pipeline benchmarks on synthetic frames")
+    parser.add_argument('--scales', nargs='+', default=['20x48', '50x120', '100x240'],
+                        help="Scales as SPOTSxFRAMES")
+    parser.add_argument('--repeat', type=int, default=1, help="Runs per scale (the best time is kept)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output-dir', default="benchmark_results")
+    parser.add_argument('--compare', default=None, help="Previous results file to compare with")
+    args = parser.parse_args()
+
+    results = []
+    for scale in args.scales:
+        n_spots, n_frames = (int(v) for v in scale.lower().split('x'))
+        work_dir = tempfile.mkdtemp(prefix="sunspot_benchmark_")
+        try:
+            result = run_scale(n_spots, n_frames, work_dir, args.repeat, args.seed)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        results.append(result)
+
+        t, a = result['timings_s'], result['accuracy']
+        print(f"{n_spots} spots x {n_frames} frames: " + "  ".join(f"{k}={t[k]:.3f}s" for k in (*STAGES, 'end_to_end')))
+        print(f"    recall={a['recall']}, precision={a['precision']}, position rms={a['position_rms_px']} px, "
+              f"fitted ABC={a['fitted_ABC']} (true {a['true_ABC']}), max rate error={a['max_rate_error_deg_per_day']} deg/day")
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    path = os.path.join(args.output_dir, f"benchmark-{datetime.now().strftime(r'%Y%m%d-%H%M%S')}.json")
+    with open(path, 'w') as f:
+        json.dump({'meta': metadata(), 'results': results}, f, indent=4)
+    print(f"Results saved to {path}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+import numpy as np
+
+'''
+This utility is the vectorized version of the notebook's rotation rate analysis.
+It works on the flat track columns (see utils/track_store.py, e.g. from tracks_to_columns,
+TrackArchive.load or SunspotTracker.store.to_columns()) sorted by track_id then time, and
+every per-track quantity is a grouped NumPy reduction instead of a loop over SkyCoord lists.
+    functions:
+        - track summaries (per-track velocity, error propagation, subsampling, median latitude)
+        - std filter
+        - differential rotation fit of latitude_model, batched over any number of weightings
+          (e.g. threshold sweeps or bootstrap resamples)
+'''
+
+ANGLE_UNCERTAINTY = 0.18 #deg
+DAY_UNCERTAINTY = 0.75 / 24 #days
+_us_per_day = 86400 * 10**6
+
+
+def latitude_model(phi_deg, A, B, C):
+    """Rotation period (days) at a latitude for omega = A + B sin^2 + C sin^4 (deg/day)"""
+    phi = phi_deg*np.pi/180
+    omega = A + B*(np.sin(phi))**2 + C*(np.sin(phi))**4
+    return 360/omega
+
+
+def track_summaries(columns, min_velocities=4, step=2, angle_uncertainty=ANGLE_UNCERTAINTY,
+                    day_uncertainty=DAY_UNCERTAINTY):
+    """
+    Per-track summaries, same values as the notebook's track_summaries loop.
+
+    Args:
+        columns: Track columns sorted by track_id then time
+        min_velocities: Keep the tracks with at least this many velocities (before subsampling)
+        step: Subsampling of the points and (separately) of the velocities, like track[key][::step]
+        angle_uncertainty: Longitude uncertainty (deg)
+        day_uncertainty: Time uncertainty (days)
+
+    Returns:
+        dict of arrays (one entry per kept track): track_id, num_points, mean_velocity, std_velocity,
+        mean_error, median_latitude, mean_period, mean_period_error
+    """
+    track_id = np.asarray(columns['track_id'])
+    n = len(track_id)
+    starts = np.flatnonzero(np.r_[True, track_id[1:] != track_id[:-1]]) if n else np.array([], dtype=np.int64)
+    counts = np.diff(np.r_[starts, n])
+    group = np.repeat(np.arange(len(starts)), counts)
+    rank = np.arange(n) - np.repeat(starts, counts)  # Position of every row inside its track
+
+    #A track of k points has k - 1 velocities (the first row has none)
+    kept = counts - 1 >= min_velocities
+    keep_rows = kept[group]
+    new_group = np.cumsum(kept) - 1
+    n_tracks = int(kept.sum())
+    lon = np.asarray(columns['lon'], dtype=float)
+    lat = np.asarray(columns['lat'], dtype=float)
+    time = np.asarray(columns['time'], dtype=np.int64)
+    velocity = np.asarray(columns['velocity'], dtype=float)
+
+    #Subsampling: points rank 0, step, 2 step... and velocities [::step], i.e. the rows rank 1, 1 + step...
+    points = keep_rows & (rank % step == 0)
+    velocity_rows = keep_rows & (rank >= 1) & ((rank - 1) % step == 0)
+
+    #Error of every subsampled point after the first: velocity [i-1] with the lon/time steps i-1 -> i
+    error_rows = np.flatnonzero(points & (rank >= step))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        delta_lambda = lon[error_rows] - lon[error_rows - step]
+        delta_t_days = (time[error_rows] - time[error_rows - step]) / _us_per_day
+        v = velocity[error_rows - step + 1]
+        error = v * np.sqrt((angle_uncertainty / delta_lambda) ** 2 + (day_uncertainty / delta_t_days) ** 2)
+    valid = delta_t_days != 0
+    error_rows, error = error_rows[valid], error[valid]
+
+    mean_velocity, std_velocity = _group_mean_std(velocity[velocity_rows], new_group[group[velocity_rows]], n_tracks)
+    mean_error, _ = _group_mean_std(error, new_group[group[error_rows]], n_tracks)
+    median_latitude = _group_median(lat[points], new_group[group[points]], n_tracks)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_period = 360 / mean_velocity
+        mean_period_error = (mean_error / mean_velocity) * mean_period
+
+    return {
+        'track_id': track_id[starts[kept]],
+        'num_points': np.bincount(new_group[group[points]], minlength=n_tracks),
+        'mean_velocity': mean_velocity,
+        'std_velocity': std_velocity,
+        'mean_error': mean_error,
+        'median_latitude': median_latitude,
+        'mean_period': mean_period,
+        'mean_period_error': mean_period_error,
+    }
+
+
+def filter_summaries(summaries, max_std=5):
+    """Keep the tracks with std_velocity < max_std"""
+    mask = summaries['std_velocity'] < max_std
+    return {name: values[mask] for name, values in summaries.items()}
+
+
+def fit_differential_rotation(latitudes, periods, errors, weights=None, n_iter=20, tol=1e-10):
+    """
+    Weighted least squares fit of latitude_model (same minimum as curve_fit with sigma=errors and
+    absolute_sigma=True). The model is linear in A, B, C for omega = 360 / period, so the linear fit
+    of omega is the starting point of a few Gauss-Newton steps on the periods.
+    Every array can have leading batch dimensions, all the fits run at once.
+    C is poorly constrained (sin^4 is nearly collinear with sin^2 at low latitudes), so curve_fit's
+    default tolerances stop up to ~2e-5 (relative) short of the minimum this converges to; with
+    ftol=xtol=gtol=1e-15 the two agree to ~3e-7.
+
+    Args:
+        latitudes: (..., n) latitudes (deg)
+        periods: (..., n) periods (days)
+        errors: (..., n) period uncertainties (days)
+        weights: Optional (..., n) multiplicity of every point (0 drops it, e.g. threshold masks
+            or bootstrap counts)
+        n_iter: Maximum number of Gauss-Newton steps
+        tol: Stop once no parameter moves by more than tol
+
+    Returns:
+        params: (..., 3) A, B, C
+        cov: (..., 3, 3) covariance of the parameters
+    """
+    weights = 1.0 if weights is None else weights
+    latitudes, periods, errors, weights = np.broadcast_arrays(
+        *(np.asarray(a, dtype=float) for a in (latitudes, periods, errors, weights)))
+    sin2 = np.sin(np.radians(latitudes)) ** 2
+    X = np.stack([np.ones_like(sin2), sin2, sin2 ** 2], axis=-1)
+    w = weights / errors ** 2
+
+    #Linear start: omega = 360 / P with sigma_omega = sigma_P * omega^2 / 360
+    omega = 360 / periods
+    w_omega = w * (360 / omega ** 2) ** 2
+    params = _solve(np.einsum('...n,...ni,...nj->...ij', w_omega, X, X),
+                    np.einsum('...n,...ni,...n->...i', w_omega, X, omega))
+
+    #Gauss-Newton on the periods
+    for _ in range(n_iter):
+        omega = np.einsum('...ni,...i->...n', X, params)
+        J = -(360 / omega ** 2)[..., None] * X
+        normal = np.einsum('...n,...ni,...nj->...ij', w, J, J)
+        step = _solve(normal, np.einsum('...n,...ni,...n->...i', w, J, periods - 360 / omega))
+        params = params + step
+        if not np.any(np.abs(step) > tol):
+            break
+
+    omega = np.einsum('...ni,...i->...n', X, params)
+    J = -(360 / omega ** 2)[..., None] * X
+    cov = _inverse(np.einsum('...n,...ni,...nj->...ij', w, J, J))
+    return params, cov
+
+
+def fit_std_thresholds(summaries, max_stds):
+    """
+    Fit latitude_model for every std filter threshold at once.
+
+    Returns:
+        params: (len(max_stds), 3) A, B, C
+        cov: (len(max_stds), 3, 3)
+    """
+    masks = summaries['std_velocity'][None, :] < np.asarray(max_stds, dtype=float)[:, None]
+    return fit_differential_rotation(summaries['median_latitude'], summaries['mean_period'],
+                                     summaries['mean_error'], weights=masks)
+
+
+def _group_mean_std(values, groups, n_groups):
+    """Grouped mean and (population) std, NaN for the empty groups"""
+    counts = np.bincount(groups, minlength=n_groups)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.bincount(groups, weights=values, minlength=n_groups) / counts
+        var = np.bincount(groups, weights=(values - mean[groups]) ** 2, minlength=n_groups) / counts
+    return mean, np.sqrt(var)
+
+
+def _group_median(values, groups, n_groups):
+    """Grouped median (one sort for all the groups), NaN for the empty groups"""
+    order = np.lexsort((values, groups))
+    values = values[order]
+    counts = np.bincount(groups, minlength=n_groups)
+    starts = np.r_[0, np.cumsum(counts)[:-1]]
+    median = np.full(n_groups, np.nan)
+    has = counts > 0
+    lo = starts[has] + (counts[has] - 1) // 2
+    hi = starts[has] + counts[has] // 2
+    median[has] = (values[lo] + values[hi]) / 2
+    return median
+
+
+def _solve(a, b):
+    """Batched solve, with a pseudo-inverse for the (rare) singular systems"""
+    try:
+        return np.linalg.solve(a, b[..., None])[..., 0]
+    except np.linalg.LinAlgError:
+        return np.einsum('...ij,...j->...i', np.linalg.pinv(a), b)
+
+
+def _inverse(a):
+    try:
+        return np.linalg.inv(a)
+    except np.linalg.LinAlgError:
+        return np.linalg.pinv(a)
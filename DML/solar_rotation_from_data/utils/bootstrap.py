@@ -0,0 +1,99 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from utils.analysis import fit_differential_rotation
+
+'''
+This utility estimates the uncertainty of the differential rotation fit (A, B, C of latitude_model)
+by resampling the track summaries instead of relying on the pcov diagonal of a single fit.
+A resample is a vector of multiplicities (how many times every track is drawn), so a whole batch of
+resamples is one batched weighted fit (see utils/analysis.fit_differential_rotation).
+    functions:
+        - bootstrap (batches spread over a process pool, one SeedSequence child per batch so the
+          result only depends on the seed, not on the number of workers)
+        - jackknife (leave-one-track-out, a single batched fit)
+'''
+
+
+def bootstrap_fit(summaries, n_resamples=10000, seed=None, n_workers=None, batch_size=1000, confidence=0.95):
+    """
+    Bootstrap the fit over the tracks.
+
+    Args:
+        summaries: Track summaries (e.g. filter_summaries(track_summaries(columns)))
+        n_resamples: Number of bootstrap resamples
+        seed: Seed of the root SeedSequence (None: fresh entropy)
+        n_workers: Number of worker processes (default: all cores, 1 runs in-process)
+        batch_size: Resamples per batched fit
+        confidence: Coverage of the percentile interval
+
+    Returns:
+        dict: 'params' (n_valid, 3) of every resample, 'fit' on the full sample, 'std', 'mean' and
+        'interval' (2, 3) of A, B, C, 'n_invalid' resamples dropped for having fewer than 3 distinct tracks
+    """
+    data = _fit_inputs(summaries)
+    fit, _ = fit_differential_rotation(*data)
+
+    #Fixed batches, each with its own child stream
+    sizes = [batch_size] * (n_resamples // batch_size)
+    if n_resamples % batch_size:
+        sizes.append(n_resamples % batch_size)
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    n_workers = n_workers or os.cpu_count() or 1
+    if n_workers == 1 or len(sizes) == 1:
+        results = [_bootstrap_batch(s, size, data) for s, size in zip(seeds, sizes)]
+    else:
+        with ProcessPoolExecutor(max_workers=min(n_workers, len(sizes))) as pool:
+            results = list(pool.map(_bootstrap_batch, seeds, sizes, [data] * len(sizes)))
+    params = np.concatenate(results)
+
+    valid = np.all(np.isfinite(params), axis=1)
+    params = params[valid]
+    alpha = (1 - confidence) / 2
+    return {
+        'params': params,
+        'fit': fit,
+        'mean': params.mean(axis=0),
+        'std': params.std(axis=0, ddof=1),
+        'interval': np.quantile(params, [alpha, 1 - alpha], axis=0),
+        'n_invalid': int((~valid).sum()),
+    }
+
+
+def jackknife_fit(summaries):
+    """
+    Leave-one-track-out jackknife of the fit.
+
+    Returns:
+        dict: 'params' (n, 3) without each track, 'fit' on the full sample, 'std' and 'bias' of A, B, C
+    """
+    data = _fit_inputs(summaries)
+    n = len(data[0])
+    fit, _ = fit_differential_rotation(*data)
+    params, _ = fit_differential_rotation(*data, weights=1 - np.eye(n))
+    mean = params.mean(axis=0)
+    return {
+        'params': params,
+        'fit': fit,
+        'std': np.sqrt((n - 1) / n * np.sum((params - mean) ** 2, axis=0)),
+        'bias': (n - 1) * (mean - fit),
+    }
+
+
+def _fit_inputs(summaries):
+    return (np.asarray(summaries['median_latitude'], dtype=float),
+            np.asarray(summaries['mean_period'], dtype=float),
+            np.asarray(summaries['mean_error'], dtype=float))
+
+
+def _bootstrap_batch(seed_sequence, size, data):
+    """Worker function: fit a batch of resamples drawn from its own stream"""
+    rng = np.random.default_rng(seed_sequence)
+    n = len(data[0])
+    counts = rng.multinomial(n, np.full(n, 1 / n), size=size)
+    params, _ = fit_differential_rotation(*data, weights=counts)
+
+    #Three parameters need at least three distinct tracks
+    params[np.count_nonzero(counts, axis=1) < 3] = np.nan
+    return params
@@ -0,0 +1,177 @@
+import os
+import json
+import tempfile
+import numpy as np
+
+from utils.track_store import to_epoch_us, from_epoch_us
+
+'''
+This utility is an indexed catalog of the downloaded frames (save_dir/YYYYMMDD/YYYYMMDD_HHMM.jpg).
+The directories are read with os.scandir and the file times are parsed from the names with
+integer arithmetic. The index is cached on disk (save_dir/.frame_index.json) together with the
+mtime of every day directory, so a refresh only rescans the days that changed.
+Frame times are kept as sorted int64 microseconds since the epoch:
+    - time range queries are a binary search (np.searchsorted)
+    - per-day lookups are a dict of slices
+    - iteration is lazy, a day directory is only scanned when the iteration reaches it
+'''
+
+index_name = ".frame_index.json"
+_us_per_day = 86400 * 10**6
+
+
+class FrameCatalog:
+    def __init__(self, root_dir: str = "sdo_hmi_jpgs", use_index: bool = True):
+        """
+        root_dir: Root directory of the images (one sub directory per day)
+        use_index: Load and save the on-disk index
+        """
+        self.root_dir = root_dir
+        self.index_path = os.path.join(root_dir, index_name) if use_index else None
+        self._days = {}  # day: {'mtime_ns': int, 'files': [str], 'times': [int]} (sorted by time)
+        self._loaded = None  # (times, paths, day slices) of the last full refresh
+        self._dirty = False
+        if self.index_path is not None and os.path.exists(self.index_path):
+            with open(self.index_path, 'r') as f:
+                self._days = json.load(f).get('days', {})
+
+    def refresh(self):
+        """Bring the index up to date with the directories (only the changed days are rescanned)"""
+        day_dirs = self._day_dirs()
+        for day in [d for d in self._days if d not in day_dirs]:
+            del self._days[day]
+            self._dirty = True
+        for day, entry in day_dirs.items():
+            self._scan_day(day, entry)
+
+        #Flat sorted view of the whole catalog
+        days = sorted(self._days)
+        times, paths, slices, start = [], [], {}, 0
+        for day in days:
+            files = self._days[day]['files']
+            times.extend(self._days[day]['times'])
+            paths.extend(os.path.join(self.root_dir, day, f) for f in files)
+            slices[day] = slice(start, start + len(files))
+            start += len(files)
+        self._loaded = (np.asarray(times, dtype=np.int64), paths, slices)
+        self.save()
+        return self
+
+    def save(self):
+        """Atomically write the index if anything changed"""
+        if self.index_path is None or not self._dirty or not os.path.isdir(self.root_dir):
+            return
+        fd, tmp_name = tempfile.mkstemp(dir=self.root_dir, suffix=".part")
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'version': 1, 'days': self._days}, f)
+        os.replace(tmp_name, self.index_path)
+        self._dirty = False
+
+    @property
+    def days(self):
+        """Sorted list of the days (YYYYMMDD) with at least one frame"""
+        return [day for day, s in self._index()[2].items() if s.stop > s.start]
+
+    def __len__(self):
+        return len(self._index()[1])
+
+    def day(self, day: str):
+        """
+        Frames of one day.
+
+        Args:
+            day: Day directory name (YYYYMMDD)
+
+        Returns:
+            file_paths, times (datetime)
+        """
+        times, paths, slices = self._index()
+        s = slices.get(day, slice(0, 0))
+        return paths[s], from_epoch_us(times[s])
+
+    def range(self, start=None, end=None):
+        """
+        Frames with start <= time < end (both optional).
+
+        Returns:
+            file_paths, times (datetime)
+        """
+        times, paths, _ = self._index()
+        lo, hi = self._bounds(times, start, end)
+        return paths[lo:hi], from_epoch_us(times[lo:hi])
+
+    def files_with_times(self):
+        """Every frame, same output as data.get_files_with_times"""
+        return self.range()
+
+    def __iter__(self):
+        return self.iter_frames()
+
+    def iter_frames(self, start=None, end=None):
+        """
+        Lazily iterate over the (file_path, time) of the frames with start <= time < end.
+        Day directories are only scanned when reached, so the first frame comes out immediately.
+        """
+        t_min = int(to_epoch_us(start)) if start is not None else None
+        t_max = int(to_epoch_us(end)) if end is not None else None
+        changed = False
+        for day, entry in sorted(self._day_dirs().items()):
+            #Skip the days outside the range without scanning them
+            day_start = _day_epoch_us(day)
+            if (t_max is not None and day_start >= t_max) or (t_min is not None and day_start + _us_per_day <= t_min):
+                continue
+            changed |= self._scan_day(day, entry)
+            times = np.asarray(self._days[day]['times'], dtype=np.int64)
+            lo, hi = self._bounds(times, start, end)
+            for file, time in zip(self._days[day]['files'][lo:hi], from_epoch_us(times[lo:hi])):
+                yield os.path.join(self.root_dir, day, file), time
+        if changed:
+            self._loaded = None
+            self.save()
+
+    def _index(self):
+        if self._loaded is None:
+            self.refresh()
+        return self._loaded
+
+    @staticmethod
+    def _bounds(times, start, end):
+        lo = np.searchsorted(times, to_epoch_us(start), side='left') if start is not None else 0
+        hi = np.searchsorted(times, to_epoch_us(end), side='left') if end is not None else len(times)
+        return int(lo), int(max(lo, hi))
+
+    def _day_dirs(self):
+        """Day directories of the root with their os.DirEntry"""
+        if not os.path.isdir(self.root_dir):
+            return {}
+        with os.scandir(self.root_dir) as entries:
+            return {e.name: e for e in entries if e.is_dir() and len(e.name) == 8 and e.name.isdigit()}
+
+    def _scan_day(self, day, entry):
+        """Rescan a day directory if its mtime changed, returns whether the index changed"""
+        mtime = entry.stat().st_mtime_ns
+        cached = self._days.get(day)
+        if cached is not None and cached['mtime_ns'] == mtime:
+            return False
+
+        day_start = _day_epoch_us(day)
+        frames = []
+        with os.scandir(entry.path) as files:
+            for f in files:
+                #File names are YYYYMMDD_HHMM.jpg
+                name = f.name
+                if not name.endswith(".jpg") or len(name) != 17 or not f.is_file():
+                    continue
+                hhmm = name[9:13]
+                if not hhmm.isdigit():
+                    continue
+                frames.append((day_start + (int(hhmm[:2]) * 60 + int(hhmm[2:])) * 60 * 10**6, name))
+        frames.sort()
+        self._days[day] = {'mtime_ns': mtime, 'files': [f for _, f in frames], 'times': [t for t, _ in frames]}
+        self._dirty = True
+        return True
+
+
+def _day_epoch_us(day: str):
+    """Start of a YYYYMMDD day in microseconds since the epoch"""
+    return int(np.datetime64(f"{day[:4]}-{day[4:6]}-{day[6:]}", 'us').astype(np.int64))
@@ -1,11 +1,15 @@
 import os
 from datetime import datetime, timedelta
-import requests
-from tqdm import tqdm
 import json
+import numpy as np
+from scipy.spatial import cKDTree
 from astropy.coordinates import SkyCoord
 
-from utils.solar_geometry import calculate_angular_velocity
+from utils.solar_geometry import calculate_angular_velocities, angular_separation
+from utils.track_store import to_epoch_us
+from utils.downloader import ImageDownloader
+from utils.profiling import instrument
+from utils.catalog import FrameCatalog
 
 
 
@@ -13,125 +17,182 @@ default_url = "https://soho.nascom.nasa.gov/data/REPROCESSING/Completed/2025/hmi
 default_save_dir = "sdo_hmi_jpgs"
 
 #Function to download images from the SOHO archive
-def fetch_images(data_bank_url: str = default_url, save_dir: str = default_save_dir, start_date: datetime = None, end_date: datetime = None, cadence: timedelta = timedelta(hours=1.5)):
+@instrument()
+def fetch_images(data_bank_url: str = default_url, save_dir: str = default_save_dir, start_date: datetime = None, end_date: datetime = None, cadence: timedelta = timedelta(hours=1.5), max_workers: int = 8, retry_missing: bool = False):
 
     os.makedirs(save_dir, exist_ok=True)
 
     #Generate all of the timestamps for each of the desired files
+    timestamps = generate_timestamps(start_date, end_date, cadence)
+    jobs = [(image_url(data_bank_url, current), image_path(save_dir, current)) for current in timestamps]
+
+    #Begin download (concurrent, resumable, see utils/downloader.py)
+    with ImageDownloader(save_dir, max_workers=max_workers) as downloader:
+        summary = downloader.download(jobs, retry_missing=retry_missing)
+    
+    if summary['failed']:
+        print(f"{summary['failed']} files failed to download, run again to retry them.")
+    if summary['missing']:
+        print(f"{summary['missing']} files are not available in the archive.")
+    if not summary['failed'] and not summary['missing']:
+        print("All requested files successfully downloaded!")
+    return summary
+
+
+#Construct the archive URL of the image taken at a given time
+def image_url(data_bank_url: str, current: datetime):
+    date_str = current.strftime(r"%Y%m%d")
+    timestamp = current.strftime(r"%Y%m%d_%H%M")
+    return f"{data_bank_url}{date_str}/{timestamp}_hmiigr_512.jpg"
+
+
+#Construct the local path of the image taken at a given time
+def image_path(save_dir: str, current: datetime):
+    date_str = current.strftime(r"%Y%m%d")
+    timestamp = current.strftime(r"%Y%m%d_%H%M")
+    return os.path.join(save_dir, date_str, f"{timestamp}.jpg")
+
+
+#Function to generate the cadence grid of observation times between two dates
+def generate_timestamps(start_date: datetime, end_date: datetime, cadence: timedelta = timedelta(hours=1.5)):
     timestamps = []
     _timestamp = start_date
     while _timestamp < end_date:
         timestamps.append(_timestamp)
         _timestamp += cadence
+    return timestamps
 
-    #Begin download
-    with tqdm(total=len(timestamps), desc="Downloading HMI images...", unit = "img") as pbar: 
-        for current in timestamps:
-            try:
-                #Construct image URL
-                date_str = current.strftime(r"%Y%m%d")
-                timestamp = current.strftime(r"%Y%m%d_%H%M")
-                url = f"{data_bank_url}{date_str}/{timestamp}_hmiigr_512.jpg"
-                
-                #Make the day directory
-                day_dir = os.path.join(save_dir,date_str)
-                os.makedirs(day_dir, exist_ok=True)
-                
-                file_name = os.path.join(day_dir, f"{timestamp}.jpg")
-                
-                #Check if the file exists already
-                if os.path.exists(file_name):
-                    pbar.update(1)
-                    continue
-                
-                #Download the image
-                response = requests.get(url, timeout=10)
-                if response.status_code == 200:
-                    with open(file_name, 'wb') as f:
-                        f.write(response.content)
-                    print(f"successfully downloaded {file_name}")
-                else:
-                    tqdm.write(f"Achtung! Image not available: {url}")
-                    
-            except Exception as e:
-                print(f"Error at {current}: {e}")
-            pbar.update(1)
-    print("All requested files successfully downloaded!")
-    
 
-# Function to extract the image paths and their timestamps
+# Function to extract the image paths and their timestamps (see utils/catalog.py for range and per-day queries)
+@instrument()
 def get_files_with_times(root_dir: str = "sdo_hmi_jpgs"):
-    file_paths = []
-    times = []
-    for day_dir in sorted(os.listdir(root_dir)):
-        day_path = os.path.join(root_dir,day_dir)
-        if os.path.isdir(day_path):
-            for file in sorted(os.listdir(day_path)):
-                if file.endswith(".jpg"):
-                    time_str = file.split('_')[1] # Extract time (hhmm)
-                    time_str = time_str.removesuffix('.jpg')
-                    time = datetime.strptime(f"{day_dir}_{time_str}", r"%Y%m%d_%H%M")
-                    file_paths.append(os.path.join(day_path,file))
-                    times.append(time)
+    file_paths, times = FrameCatalog(root_dir).files_with_times()
     return file_paths, times
 
 #Function to merge tracks based on proximity to others
+@instrument()
 def track_association(data: list[dict] = None, max_gap_hours = 3, max_distance_deg = 5):
-
-# Create a table to stitch short tracks into longer ones
+    """
+    Stitch short tracks into longer ones: the end of a track is linked to the start of another track
+    if it starts 0 < gap <= max_gap_hours later and at most max_distance_deg away. Links chain, so a
+    stitched track can be made of several pieces, and the velocity across every link is added.
+    The input tracks are not modified.
+    """
+    if not data:
+        return []
+    
+    #End and start point of every track
+    end_times = to_epoch_us([t['times'][-1] for t in data])
+    start_times = to_epoch_us([t['times'][0] for t in data])
+    end_lon, end_lat = _lon_lat([t['positions_helio'][-1] for t in data])
+    start_lon, start_lat = _lon_lat([t['positions_helio'][0] for t in data])
+    
+    successor = _stitch_links(end_times, end_lon, end_lat, start_times, start_lon, start_lat, max_gap_hours, max_distance_deg)
+    
+    #Velocity across every link
+    has_link = successor >= 0
+    bridge = np.full(len(data), np.nan)
+    bridge[has_link] = calculate_angular_velocities(end_lon[has_link], end_times[has_link],
+                                                    start_lon[successor[has_link]], start_times[successor[has_link]])
+    
+    #Follow the chains from every track that isn't the continuation of another one
+    has_predecessor = np.zeros(len(data), dtype=bool)
+    has_predecessor[successor[has_link]] = True
     merged_tracks = []
-    used = set()
-
-    for i, t1 in enumerate(data):
-        if i in used:
-            continue
-        merged = t1.copy()
-        used.add(i)
-        for j, t2 in enumerate(data):
-            if j in used or i == j:
-                continue
-            # Compare end of t1 to start of t2
-            time_gap = (t2["times"][0] - t1["times"][-1]).total_seconds() / 3600.0
-            # print(i,j,t2["times"][0], t1["times"][-1],time_gap)
-            if 0 < time_gap <= max_gap_hours:
-                dist = t1["positions_helio"][-1].separation(t2["positions_helio"][0]).deg
-                if dist <= max_distance_deg:
-                    # Merge t2 into merged
-                    
-                    '''
-                    calculate velocity between them,
-                    add velocity,
-                    then merge.
-                    '''
-                    #calculate the velocity between the merging points
-                    new_velocity = calculate_angular_velocity(
-                        t1['positions_helio'][-1],
-                        t1['times'][-1],
-                        t2['positions_helio'][0], 
-                        t2['times'][0]
-                        )
-                    merged['velocities'].append(new_velocity)
-                    
-                    #then merge the rest
-                    for key in t1.keys():
-                        merged[key].extend(t2[key])
-                    used.add(j)
+    for i in np.flatnonzero(~has_predecessor):
+        merged = {key: list(value) for key, value in data[i].items()}
+        while successor[i] >= 0:
+            merged['velocities'].append(float(bridge[i]))
+            i = successor[i]
+            for key in merged.keys():
+                merged[key].extend(data[i][key])
         merged_tracks.append(merged)
     return merged_tracks
 
-#function to convert to JSON
+
+def _lon_lat(coords):
+    """Longitude and latitude arrays (degrees) of a list of SkyCoords"""
+    lon = np.array([c.lon.deg for c in coords], dtype=float)
+    lat = np.array([c.lat.deg for c in coords], dtype=float)
+    return lon, lat
+
+
+def _stitch_links(end_times, end_lon, end_lat, start_times, start_lon, start_lat, max_gap_hours, max_distance_deg):
+    """
+    Find the track links used for stitching.
+    Track starts are indexed by time (sorted start times) and by position (KD tree on unit vectors),
+    so every track end is only compared with the starts inside the gap and distance windows.
+    Candidate links are then accepted from the closest in time (then in distance) onwards, with at
+    most one successor and one predecessor per track.
+    
+    Returns:
+        successor: Index of the track following each track, -1 if none
+    """
+    n = len(end_times)
+    successor = np.full(n, -1)
+    
+    #Spatial index: chord length between unit vectors is monotonic in the angular separation
+    tree = cKDTree(_unit_vectors(start_lon, start_lat))
+    chord = 2 * np.sin(np.radians(min(max_distance_deg, 180)) / 2)
+    neighbours = tree.query_ball_point(_unit_vectors(end_lon, end_lat), r=chord * (1 + 1e-9))
+    
+    #Time index: rank of every start in time order
+    order = np.argsort(start_times, kind='stable')
+    rank = np.empty(n, dtype=np.int64)
+    rank[order] = np.arange(n)
+    sorted_starts = start_times[order]
+    lo = np.searchsorted(sorted_starts, end_times, side='right')  # gap > 0
+    hi = np.searchsorted(sorted_starts, end_times + int(max_gap_hours * 3600 * 10**6), side='right')  # gap <= max
+    
+    ends, starts = [], []
+    for i, candidates in enumerate(neighbours):
+        if not candidates or lo[i] == hi[i]:
+            continue
+        candidates = np.asarray(candidates)
+        candidates = candidates[(rank[candidates] >= lo[i]) & (rank[candidates] < hi[i])]
+        ends.append(np.full(len(candidates), i))
+        starts.append(candidates)
+    if not ends:
+        return successor
+    ends, starts = np.concatenate(ends), np.concatenate(starts)
+    
+    #Exact (vectorized) checks of the candidates
+    gap = start_times[starts] - end_times[ends]
+    dist = angular_separation(end_lon[ends], end_lat[ends], start_lon[starts], start_lat[starts])
+    valid = dist <= max_distance_deg
+    ends, starts, gap, dist = ends[valid], starts[valid], gap[valid], dist[valid]
+    
+    #Accept the closest links first
+    has_predecessor = np.zeros(n, dtype=bool)
+    for k in np.lexsort((starts, ends, dist, gap)):
+        if successor[ends[k]] < 0 and not has_predecessor[starts[k]]:
+            successor[ends[k]] = starts[k]
+            has_predecessor[starts[k]] = True
+    return successor
+
+
+def _unit_vectors(lon, lat):
+    lon, lat = np.radians(lon), np.radians(lat)
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+#function to convert to JSON (see utils/track_archive.py for the faster binary format)
+@instrument()
 def toJSON(data: list[dict] = None, file_name: str = None):
-    #First convert necessary datatypes to str
+    #First convert necessary datatypes to str (on copies, so the input tracks are left untouched)
+    converted = []
     for entry in data:
+        entry = dict(entry)
         if 'times' in entry:
             entry['times'] = [t.isoformat() if isinstance(t, datetime) else t for t in entry['times']]
         if 'positions_helio' in entry:
             entry['positions_helio'] = [skycoord_to_dict(coord) if isinstance(coord, SkyCoord) else coord for coord in entry['positions_helio']]
+        converted.append(entry)
 
     with open(file=file_name,mode='w') as f:
-        json.dump(data, f, indent=4)
+        json.dump(converted, f, indent=4)
 
 #Convert JSON data back into useable format
+@instrument()
 def fromJSON(data_path: str = "sunspot_data.json"):
     with open(data_path, 'r') as f:
         data = json.load(f)
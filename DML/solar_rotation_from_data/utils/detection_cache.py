@@ -0,0 +1,124 @@
+import os
+import hashlib
+import tempfile
+import numpy as np
+
+from utils.image_processing import detect_sunspots
+
+'''
+This utility is a persistent cache of the sunspot detections.
+An entry holds the centroids, solar center and solar radius of one image and is keyed by
+the hash of the image file plus the detection parameters, so a renamed or re-downloaded
+but unchanged image is still a hit and a changed parameter is always a miss.
+The cache is stored as a compact columnar .npz file:
+    keys: (N,) entry keys
+    centers: (N, 2) solar centers (px)
+    radii: (N,) solar radii (px)
+    offsets: (N + 1,) start of each entry in the centroid column
+    centroids: (M, 2) all centroids (px) back to back
+'''
+
+default_cache_path = "detection_cache.npz"
+
+
+def file_hash(image_path: str):
+    """Hash of the image content"""
+    with open(image_path, 'rb') as f:
+        return hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+
+
+class DetectionCache:
+    def __init__(self, path: str = default_cache_path):
+        """
+        path: Location of the .npz store (None keeps the cache in memory only)
+        """
+        self.path = path
+        self.entries = {}  # key: (centroids, solar_center, solar_radius)
+        self.hits = 0
+        self.misses = 0
+        self._dirty = False
+        if path is not None and os.path.exists(path):
+            self.load()
+
+    @staticmethod
+    def make_key(image_hash, sunspot_threshold=25, min_area=16, kernel_size=3):
+        return f"{image_hash}:{sunspot_threshold}:{min_area}:{kernel_size}"
+
+    def key(self, image_path, sunspot_threshold=25, min_area=16, kernel_size=3):
+        return self.make_key(file_hash(image_path), sunspot_threshold, min_area, kernel_size)
+
+    def get(self, key):
+        """Cached (centroids, solar_center, solar_radius) or None"""
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def put(self, key, centroids, solar_center, solar_radius):
+        #Same python types as detect_sunspots returns
+        centroids = [(int(x), int(y)) for x, y in centroids]
+        self.entries[key] = (centroids, (int(solar_center[0]), int(solar_center[1])), int(solar_radius))
+        self._dirty = True
+
+    def detect(self, image_path, sunspot_threshold=25, min_area=16, kernel_size=3):
+        """
+        Cached version of detect_sunspots (without the decoded image).
+
+        Returns:
+            centroids, solar_center, solar_radius
+        """
+        key = self.key(image_path, sunspot_threshold, min_area, kernel_size)
+        entry = self.get(key)
+        if entry is None:
+            _, centroids, solar_center, solar_radius = detect_sunspots(image_path, sunspot_threshold, min_area, kernel_size)
+            self.put(key, centroids, solar_center, solar_radius)
+            entry = self.entries[key]
+        return entry
+
+    def load(self):
+        with np.load(self.path) as store:
+            keys = store['keys']
+            centers = store['centers']
+            radii = store['radii']
+            offsets = store['offsets']
+            centroids = store['centroids']
+        for i, key in enumerate(keys):
+            points = centroids[offsets[i]:offsets[i + 1]]
+            self.entries[str(key)] = (
+                [(int(x), int(y)) for x, y in points],
+                (int(centers[i, 0]), int(centers[i, 1])),
+                int(radii[i]),
+            )
+        self._dirty = False
+
+    def save(self):
+        """Write the cache to disk (atomically) if anything changed"""
+        if self.path is None or not self._dirty:
+            return
+        keys = list(self.entries)
+        counts = np.array([len(self.entries[k][0]) for k in keys], dtype=np.int64)
+        offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        centroids = np.array([p for k in keys for p in self.entries[k][0]], dtype=np.int32).reshape(-1, 2)
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_name = tempfile.mkstemp(dir=directory, suffix=".npz")
+        with os.fdopen(fd, 'wb') as f:
+            np.savez_compressed(
+                f,
+                keys=np.array(keys, dtype=str),
+                centers=np.array([self.entries[k][1] for k in keys], dtype=np.int32).reshape(-1, 2),
+                radii=np.array([self.entries[k][2] for k in keys], dtype=np.int32),
+                offsets=offsets,
+                centroids=centroids,
+            )
+        os.replace(tmp_name, self.path)
+        self._dirty = False
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
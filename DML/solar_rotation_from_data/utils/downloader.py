@@ -0,0 +1,176 @@
+import os
+import json
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from tqdm import tqdm
+
+'''
+This utility is the download engine behind data.fetch_images.
+    features:
+        - keep-alive connection pooling (one shared requests session)
+        - bounded number of concurrent workers
+        - retries with exponential backoff on connection errors and 5xx responses
+        - atomic writes (temp file in the day directory, then rename)
+        - a manifest so interrupted runs resume and known-missing URLs aren't probed again
+'''
+
+default_manifest_name = "download_manifest.json"
+
+
+def _default_file_mode():
+    """Mode of a file created with open() under the current umask (mkstemp files are 0600)"""
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+class ImageDownloader:
+    def __init__(self, save_dir, max_workers=8, retries=3, backoff_factor=0.5, timeout=10,
+                 manifest_name=default_manifest_name, manifest_interval=50):
+        """
+        save_dir: Root directory of the image archive (the manifest is stored there)
+        max_workers: Maximum number of concurrent downloads (and pooled connections)
+        retries: Number of retries per URL for connection errors and 5xx responses
+        backoff_factor: Backoff between retries is backoff_factor * 2^(retry - 1) seconds
+        timeout: Timeout of a single request (seconds)
+        manifest_interval: Number of finished jobs between manifest checkpoints
+        """
+        self.save_dir = save_dir
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.manifest_interval = manifest_interval
+        self.manifest_path = os.path.join(save_dir, manifest_name)
+        self.manifest = self._load_manifest()
+        self._lock = threading.Lock()
+        self._file_mode = _default_file_mode()
+
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(["GET"]),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def download(self, jobs, retry_missing=False, progress=True):
+        """
+        Download a list of (url, file_name) jobs concurrently.
+
+        Args:
+            jobs: List of (url, file_name) tuples
+            retry_missing: Probe the URLs recorded as missing in the manifest again
+            progress: Show a tqdm progress bar
+
+        Returns:
+            dict: Counts of 'downloaded', 'skipped', 'missing' and 'failed' files
+        """
+        summary = {'downloaded': 0, 'skipped': 0, 'missing': 0, 'failed': 0}
+        missing = set(self.manifest['missing'])
+        if retry_missing:
+            missing.clear()
+            self.manifest['missing'] = []
+
+        #Skip the files that already exist and the URLs known to be missing
+        pending = []
+        for url, file_name in jobs:
+            if os.path.exists(file_name):
+                summary['skipped'] += 1
+            elif url in missing:
+                summary['missing'] += 1
+            else:
+                pending.append((url, file_name))
+
+        with tqdm(total=len(jobs), initial=len(jobs) - len(pending), desc="Downloading HMI images...",
+                  unit="img", disable=not progress) as pbar:
+            pool = ThreadPoolExecutor(max_workers=self.max_workers)
+            try:
+                futures = {pool.submit(self._fetch, url, file_name): url for url, file_name in pending}
+                for done, future in enumerate(as_completed(futures), start=1):
+                    url = futures[future]
+                    try:
+                        status = future.result()
+                    except Exception as e:
+                        tqdm.write(f"Error at {url}: {e}")
+                        status = 'failed'
+                    summary[status] += 1
+                    if status == 'missing':
+                        tqdm.write(f"Achtung! Image not available: {url}")
+                    pbar.update(1)
+                    #Checkpoint the manifest so an interrupted run can resume
+                    if done % self.manifest_interval == 0:
+                        self.save_manifest()
+            finally:
+                #Drop the queued downloads on an interrupt (the running ones finish)
+                pool.shutdown(wait=True, cancel_futures=True)
+                self.save_manifest()
+        return summary
+
+    def _fetch(self, url, file_name):
+        """Download one URL into file_name, returning the status of the job"""
+        with self.session.get(url, timeout=self.timeout, stream=True) as response:
+            if response.status_code == 404:
+                with self._lock:
+                    self.manifest['missing'].append(url)
+                return 'missing'
+            if response.status_code != 200:
+                return 'failed'
+
+            #Write to a temporary file next to the target so the rename is atomic
+            day_dir = os.path.dirname(file_name)
+            os.makedirs(day_dir, exist_ok=True)
+            fd, tmp_name = tempfile.mkstemp(dir=day_dir, suffix=".part")
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=64 * 1024):
+                        f.write(chunk)
+                #Same permissions as a file written with open()
+                os.chmod(tmp_name, self._file_mode)
+                os.replace(tmp_name, file_name)
+            except BaseException:
+                if os.path.exists(tmp_name):
+                    os.remove(tmp_name)
+                raise
+
+        with self._lock:
+            self.manifest['downloaded'][url] = os.path.relpath(file_name, self.save_dir)
+        return 'downloaded'
+
+    def _load_manifest(self):
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, 'r') as f:
+                manifest = json.load(f)
+        else:
+            manifest = {}
+        manifest.setdefault('downloaded', {})
+        manifest.setdefault('missing', [])
+        return manifest
+
+    def save_manifest(self):
+        """Atomically write the manifest to disk"""
+        os.makedirs(self.save_dir, exist_ok=True)
+        with self._lock:
+            manifest = {
+                'downloaded': dict(self.manifest['downloaded']),
+                'missing': sorted(set(self.manifest['missing'])),
+            }
+        fd, tmp_name = tempfile.mkstemp(dir=self.save_dir, suffix=".part")
+        with os.fdopen(fd, 'w') as f:
+            json.dump(manifest, f, indent=4)
+        os.replace(tmp_name, self.manifest_path)
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,88 +1,257 @@
 import numpy as np
-from scipy.spatial import KDTree
-from utils.solar_geometry import pixel_to_heliographic, calculate_angular_velocity
+from scipy.spatial import KDTree, cKDTree
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.optimize import linear_sum_assignment
+from utils.solar_geometry import pixel_to_heliographic, pixels_to_heliographic, calculate_angular_velocities
+from utils.profiling import instrument
+from utils.track_store import TrackStore, to_epoch_us, columns_to_dicts, concat_columns, split_tracks
 
 class SunspotTracker:
-    def __init__(self, solar_center_px, solar_radius_px, max_angular_speed=2):  # deg/hr
+    def __init__(self, solar_center_px, solar_radius_px, max_angular_speed=2, max_gap_hours=3,
+                 streaming=False, on_track_finished=None, assignment='greedy', limb_cutoff=0.85):  # deg/hr
         """
         solar_radius_px: Radius of Sun in pixels
         max_angular_speed: Maximum expected angular speed (deg/hr)
+        max_gap_hours: Maximum time gap between two observations of a track
+        limb_cutoff: Centroids further than limb_cutoff * solar_radius from the center are ignored
+        assignment: 'greedy' nearest neighbour per track (several tracks can claim the same centroid),
+            or 'optimal' one-to-one matching with the minimum total distance inside the max_speed radius
+        streaming: Retire the tracks that can't be continued anymore out of the active store,
+            so memory and per-frame time stay flat no matter how long the run is
+        on_track_finished: Optional callback receiving each retired track (dict of columns) in
+            streaming mode. Without a callback the retired tracks are kept in self.finished
         """
         self.solar_center = solar_center_px
         self.solar_radius = solar_radius_px
         self.max_speed = max_angular_speed
-        self.tracks = []  # List of dicts: {'positions_px': [list], 'positions_helio': [SkyCoords] 'times': [datetime], 'velocities': [float]}
+        self.limb_cutoff = limb_cutoff
+        if assignment not in ('greedy', 'optimal'):
+            raise ValueError(f"Unknown assignment mode: {assignment}")
+        self.assignment = assignment
+        self.max_gap = int(max_gap_hours * 3600 * 10**6)  # us
+        self.streaming = streaming
+        self.on_track_finished = on_track_finished
+        self.store = TrackStore()  # Columnar observations (see utils/track_store.py), only the live tracks when streaming
+        self.finished = TrackStore()  # Retired tracks in streaming mode without a callback
+        self.active = _empty_tails()  # Tails (last observation) of the live tracks only
+        self._tracks_cache = (None, [])
+        self._finished_queue = None  # Retired tracks not handed out by stream() yet
+
+    @property
+    def tracks(self):
+        """List of dicts: {'positions_px': [list], 'positions_helio': [SkyCoords] 'times': [datetime], 'velocities': [float]}"""
+        version, tracks = self._tracks_cache
+        current = (self.store.version, self.finished.version)
+        if version != current:
+            columns = concat_columns(self.finished.to_columns(), self.store.to_columns())
+            order = np.lexsort((columns['time'], columns['track_id']))
+            tracks = columns_to_dicts({name: column[order] for name, column in columns.items()})
+            self._tracks_cache = (current, tracks)
+        return tracks
         
+    @instrument(per_frame=True)
     def process_frame(self, frame_time, centroids):
         """Process a new frame of sunspot positions"""
         centroids = self.filter_limb_features(centroids) #This is to try and eliminate negative velocities
+        time = to_epoch_us(frame_time)
+        
+        #Convert new centroids into heliographic coords (one batch per frame)
+        positions = np.asarray(centroids, dtype=np.int32).reshape(-1, 2)
+        lon, lat = pixels_to_heliographic(positions, frame_time, self.solar_center, self.solar_radius)
+        valid = np.isfinite(lon) & np.isfinite(lat)
+        positions, lon, lat = positions[valid], lon[valid], lat[valid]
+        
+        #Time gap validation: those tracks leave the active index for good
+        self._expire(time)
         
-        if not self.tracks:  # First frame initialization
-            for pos in centroids:
-                pos_helio = self._pixel_to_angular(pos,frame_time)
-                self.tracks.append({
-                    'positions_px': [pos],
-                    'positions_helio': [pos_helio],
-                    'times': [frame_time],
-                    'velocities': []
-                })
-            return
+        #Match the live tracks to the new centroids
+        track_idx, match_idx, velocities = self._match(time, lon, lat)
         
-        #Convert new centroids into heliographic coords
-        current_angular = [self._pixel_to_angular(c, frame_time) for c in centroids]
-        current_angular_tuple = [(p.lon.deg % 360, p.lat.deg) for p in current_angular]
+        '''Update tracks'''
+        self.store.append(self.active['track_id'][track_idx], time, positions[match_idx, 0], positions[match_idx, 1],
+                          lon[match_idx], lat[match_idx], velocities)
+        self.active['time'][track_idx] = time
+        self.active['lon'][track_idx] = lon[match_idx]
+        self.active['lat'][track_idx] = lat[match_idx]
+        
+        #Start new tracks for unmatched centroids
+        unmatched = np.ones(len(positions), dtype=bool)
+        unmatched[match_idx] = False
+        new_ids = self.store.new_track_ids(int(unmatched.sum()))
+        self.store.append(new_ids, time, positions[unmatched, 0], positions[unmatched, 1],
+                          lon[unmatched], lat[unmatched], np.nan)
+        self.active = {
+            'track_id': np.concatenate([self.active['track_id'], new_ids]),
+            'time': np.concatenate([self.active['time'], np.full(len(new_ids), time, dtype=np.int64)]),
+            'lon': np.concatenate([self.active['lon'], lon[unmatched]]),
+            'lat': np.concatenate([self.active['lat'], lat[unmatched]]),
+        }
+
+    @instrument()
+    def _expire(self, time):
+        """Remove the tails older than the maximum time gap from the active index"""
+        live = (time - self.active['time']) <= self.max_gap
+        if not live.all():
+            expired = self.active['track_id'][~live]
+            self.active = {name: column[live] for name, column in self.active.items()}
+            if self.streaming:
+                self._retire(expired)
+
+    @instrument()
+    def _retire(self, track_ids):
+        """Move finished tracks out of the active store (streaming mode)"""
+        columns = self.store.pop_tracks(track_ids)
+        if self._finished_queue is not None:
+            self._finished_queue.append(columns)  # Handed out by stream()
+        elif self.on_track_finished is not None:
+            for track in split_tracks(columns):
+                self.on_track_finished(track)
+        else:
+            self.finished.extend(columns)
+
+    def finish(self):
+        """End of the run: retire every track that is still live (streaming mode)"""
+        if self.streaming:
+            self._retire(self.active['track_id'])
+            self.active = _empty_tails()
+
+    def stream(self, frames):
+        """
+        Generator version of the streaming tracker.
         
+        Args:
+            frames: Iterable of (frame_time, centroids)
         
-        # Convert existing tracks to helio coords
-        prev_angular = [t['positions_helio'][-1] for t in self.tracks]
-        prev_angular_tuple = [(p.lon.deg % 360, p.lat.deg) for p in prev_angular]
+        Yields:
+            Each track (dict of columns) as soon as it can't be continued anymore
+        """
+        self.streaming = True
+        self._finished_queue = []
+        try:
+            for frame_time, centroids in frames:
+                self.process_frame(frame_time, centroids)
+                yield from self._drain()
+            self.finish()
+            yield from self._drain()
+        finally:
+            self._finished_queue = None
+
+    def _drain(self):
+        queue, self._finished_queue = self._finished_queue, []
+        for columns in queue:
+            yield from split_tracks(columns)
+
+    @instrument()
+    def _match(self, time, lon, lat):
+        """
+        Match the live track tails to the new centroids.
         
+        Returns:
+            track_idx: Indices (into the active index) of the updated tracks
+            match_idx: Index of the centroid each of them was matched to
+            velocities: Angular velocity (deg/day) of each update
+        """
+        if len(self.active['track_id']) == 0 or len(lon) == 0:
+            return np.array([], dtype=np.intp), np.array([], dtype=np.intp), np.array([])
+        if self.assignment == 'optimal':
+            return self._match_optimal(time, lon, lat)
         
+        #Greedy nearest neighbour matching
         # Find nearest neighbors
-        tree = KDTree(current_angular_tuple) 
-        distances, indices = tree.query(prev_angular_tuple, distance_upper_bound=self.max_speed)
+        tree = KDTree(np.column_stack([lon % 360, lat]))
+        prev_angular = np.column_stack([self.active['lon'] % 360, self.active['lat']])
+        _, indices = tree.query(prev_angular, distance_upper_bound=self.max_speed)
         
+        #Check if there are more matches than centroids
+        track_idx = np.flatnonzero(indices < len(lon))
+        match_idx = indices[track_idx]
         
-        # Update tracks
-        updated = set()
-        for track_idx, (dist, match_idx) in enumerate(zip(distances, indices)):
-            '''Perform validation checks'''
-            #Check if there are more matches than centroids
-            if match_idx >= len(centroids):
-                continue
-            
-            new_pos = centroids[match_idx]
-            assert isinstance(self.tracks[track_idx]['times'], list) #Some type protection because of a bug where a list was just datetime
-            prev_time = self.tracks[track_idx]['times'][-1]
-            
-            
-            #Time gap validation (max 3 hours)
-            if (frame_time - prev_time).total_seconds() > 3*3600:
-                continue
-            
-            #Velocity validation
-            # print(f"prev_angular = {prev_angular}\ncurrent_angular = {current_angular}\ntrack_idx = {track_idx}")
-            velocity = calculate_angular_velocity(prev_angular[track_idx], prev_time, current_angular[match_idx], frame_time)
-            if abs(velocity) > 15: #deg/day
+        #Velocity validation
+        velocities = calculate_angular_velocities(self.active['lon'][track_idx], self.active['time'][track_idx],
+                                                  lon[match_idx], time)
+        keep = ~(np.abs(velocities) > 15) #deg/day
+        return track_idx[keep], match_idx[keep], velocities[keep]
+
+    @instrument()
+    def _match_optimal(self, time, lon, lat):
+        """
+        Sparse gated one-to-one matching: candidate pairs are the (tail, centroid) pairs closer than
+        max_speed that pass the velocity validation, and every connected group of candidates is solved
+        as a linear sum assignment (maximum number of matches, then minimum total distance).
+        """
+        prev_angular = np.column_stack([self.active['lon'] % 360, self.active['lat']])
+        current_angular = np.column_stack([lon % 360, lat])
+        pairs = cKDTree(prev_angular).sparse_distance_matrix(cKDTree(current_angular), self.max_speed, output_type='ndarray')
+        pairs = pairs[pairs['v'] < self.max_speed]  # Same strict bound as the greedy query
+        
+        #Velocity validation of every candidate pair
+        velocities = calculate_angular_velocities(self.active['lon'][pairs['i']], self.active['time'][pairs['i']],
+                                                  lon[pairs['j']], time)
+        keep = ~(np.abs(velocities) > 15) #deg/day
+        pairs, velocities = pairs[keep], velocities[keep]
+        if len(pairs) == 0:
+            return np.array([], dtype=np.intp), np.array([], dtype=np.intp), np.array([])
+        
+        #Independent groups of tails and centroids competing for each other (bipartite graph components)
+        n_prev, n_cur = len(prev_angular), len(current_angular)
+        graph = coo_matrix((np.ones(len(pairs)), (pairs['i'], n_prev + pairs['j'])), shape=(n_prev + n_cur,) * 2)
+        _, labels = connected_components(graph, directed=False)
+        edge_labels = labels[pairs['i']]
+        
+        chosen = []
+        order = np.lexsort((pairs['j'], pairs['i'], edge_labels))  # Deterministic order of the groups
+        groups = np.split(order, np.flatnonzero(np.diff(edge_labels[order])) + 1)
+        for edges in groups:
+            if len(edges) == 1:
+                chosen.append(edges[0])
                 continue
-            
-            '''Update tracks'''
-            self.tracks[track_idx]['positions_px'].append(new_pos)
-            self.tracks[track_idx]['positions_helio'].append(current_angular[match_idx])
-            self.tracks[track_idx]['times'].append(frame_time)
-            self.tracks[track_idx]['velocities'].append(velocity)
-            updated.add(match_idx)
-            
-        #Start new tracks for unmatched centroids
-        for i, pos in enumerate(centroids):
-            if i not in updated:
-                self.tracks.append({
-                    'positions_px': [pos],
-                    'positions_helio': [current_angular[i]],
-                    'times': [frame_time],
-                    'velocities': []
-                })
+            rows, row_idx = np.unique(pairs['i'][edges], return_inverse=True)
+            cols, col_idx = np.unique(pairs['j'][edges], return_inverse=True)
+            cost = np.full((len(rows), len(cols)), _NO_EDGE)
+            edge_id = np.full((len(rows), len(cols)), -1)
+            cost[row_idx, col_idx] = pairs['v'][edges]
+            edge_id[row_idx, col_idx] = edges
+            r, c = linear_sum_assignment(cost)
+            matched = edge_id[r, c]
+            chosen.extend(matched[matched >= 0])
         
+        chosen = np.sort(np.array(chosen, dtype=np.intp))
+        return pairs['i'][chosen].astype(np.intp), pairs['j'][chosen].astype(np.intp), velocities[chosen]
+
+    def get_state(self):
+        """Serializable state of the tracker: settings, active index and the observations in the store"""
+        state = {
+            'solar_center': np.asarray(self.solar_center),
+            'solar_radius': self.solar_radius,
+            'max_speed': self.max_speed,
+            'max_gap': self.max_gap,
+            'streaming': self.streaming,
+            'assignment': self.assignment,
+            'limb_cutoff': self.limb_cutoff,
+            'next_track_id': self.store.next_track_id,
+        }
+        state.update({f"active_{name}": column for name, column in self.active.items()})
+        state.update({f"store_{name}": column for name, column in self.store.to_columns().items()})
+        return state
+
+    @classmethod
+    def from_state(cls, state, on_track_finished=None):
+        """Rebuild a tracker from get_state (e.g. after loading it from a checkpoint)"""
+        tracker = cls(
+            tuple(int(c) for c in state['solar_center']),
+            int(state['solar_radius']),
+            float(state['max_speed']),
+            streaming=bool(state['streaming']),
+            on_track_finished=on_track_finished,
+            assignment=str(state['assignment']),
+            limb_cutoff=float(state.get('limb_cutoff', 0.85)),
+        )
+        tracker.max_gap = int(state['max_gap'])
+        tracker.active = {name: np.array(state[f"active_{name}"]) for name in tracker.active}
+        tracker.store.extend({name: state[f"store_{name}"] for name in tracker.store.to_columns()})
+        tracker.store.next_track_id = int(state['next_track_id'])
+        return tracker
 
     def _pixel_to_angular(self, position, time):
         """Convert pixel position to angular coordinates (degrees from center)"""
@@ -132,6 +301,19 @@ class SunspotTracker:
         filtered = []
         for x, y in centroids:
             r = np.hypot(x - center[0], y - center[1]) / self.solar_radius
-            if r <= 0.85:
+            if r <= self.limb_cutoff:
                 filtered.append((x, y))
         return filtered
+
+
+def _empty_tails():
+    return {
+        'track_id': np.array([], dtype=np.int64),
+        'time': np.array([], dtype=np.int64),
+        'lon': np.array([], dtype=np.float64),
+        'lat': np.array([], dtype=np.float64),
+    }
+
+
+# Cost of a non-candidate pair in the assignment, far above any gated distance
+_NO_EDGE = 1e9
@@ -0,0 +1,186 @@
+import os
+import json
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from utils.image_processing import load_frame
+from utils.track_store import to_epoch_us, from_epoch_us
+
+'''
+This utility decodes the image archive once into a memory-mapped grayscale stack, so detection,
+visualization and sweeps read zero-copy slices instead of decoding the JPEGs again.
+A stack is a directory:
+    stack.json: Header with the frame shape and the number of committed frames
+    frames.u8: Raw uint8 frames back to back (frames x height x width)
+    times.i64: Raw int64 frame times (us since the epoch), sorted
+    sources.txt: Source image of every frame, one per line
+Frames are only appended at the end of the files, and the header is written last, so an append
+never rewrites the stack and an interrupted one is ignored (and overwritten by the next one).
+'''
+
+header_name = "stack.json"
+# Stacks opened by this process for stack_frame (path: FrameStack)
+_open_stacks = {}
+
+
+class FrameStack:
+    def __init__(self, path: str, shape=(512, 512)):
+        """
+        path: Stack directory (created if needed)
+        shape: (height, width) of the frames of an empty stack (set by its first frame)
+        """
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        header_path = os.path.join(path, header_name)
+        if os.path.exists(header_path):
+            with open(header_path, 'r') as f:
+                self.header = json.load(f)
+        else:
+            self.header = {'version': 1, 'height': int(shape[0]), 'width': int(shape[1]), 'n_frames': 0}
+        self._open()
+
+    @property
+    def shape(self):
+        return self.header['height'], self.header['width']
+
+    def __len__(self):
+        return self.header['n_frames']
+
+    def __getitem__(self, index):
+        """Zero-copy (read-only) frame or frames"""
+        return self.frames[index]
+
+    def last_time(self):
+        """Time of the last frame (int64 us since the epoch), or None if empty"""
+        return int(self.times[-1]) if len(self) else None
+
+    def index_of(self, time):
+        """Index of the frame taken at a time, or None"""
+        t = to_epoch_us(time)
+        i = int(np.searchsorted(self.times, t))
+        return i if i < len(self) and self.times[i] == t else None
+
+    def frame(self, time):
+        """Frame taken at a time (KeyError if it isn't in the stack)"""
+        i = self.index_of(time)
+        if i is None:
+            raise KeyError(f"No frame at {time}")
+        return self.frames[i]
+
+    def range(self, start=None, end=None):
+        """
+        Frames with start <= time < end (both optional).
+
+        Returns:
+            frames (zero-copy view), times (datetime), sources
+        """
+        lo = int(np.searchsorted(self.times, to_epoch_us(start))) if start is not None else 0
+        hi = int(np.searchsorted(self.times, to_epoch_us(end))) if end is not None else len(self)
+        hi = max(lo, hi)
+        return self.frames[lo:hi], from_epoch_us(self.times[lo:hi]), self.sources[lo:hi]
+
+    def append(self, gray_frames, times, sources=None):
+        """
+        Append frames newer than the last one.
+
+        Args:
+            gray_frames: (n, height, width) uint8 frames (or a list of them)
+            times: Time of every frame (datetime), increasing
+            sources: Optional source image of every frame
+        """
+        n = len(times)
+        if n == 0:
+            return
+        epoch_times = to_epoch_us(times)
+        if np.any(np.diff(epoch_times) <= 0) or (len(self) and epoch_times[0] <= self.times[-1]):
+            raise ValueError("Frames must be appended in increasing time order, after the last frame")
+        sources = [str(s) for s in sources] if sources is not None else [""] * n
+        if len(self) == 0:
+            #A new stack takes the shape of its first frame
+            self.header['height'], self.header['width'] = (int(d) for d in np.shape(gray_frames[0]))
+        frame_bytes = self.shape[0] * self.shape[1]
+
+        #Drop whatever an interrupted append left after the committed frames, then append
+        with open(self._file("frames.u8"), 'ab') as f:
+            f.truncate(len(self) * frame_bytes)
+            for gray_img in gray_frames:
+                gray_img = np.ascontiguousarray(gray_img, dtype=np.uint8)
+                if gray_img.shape != self.shape:
+                    raise ValueError(f"Frame shape {gray_img.shape} doesn't match the stack {self.shape}")
+                f.write(gray_img.tobytes())
+        with open(self._file("times.i64"), 'ab') as f:
+            f.truncate(len(self) * 8)
+            f.write(epoch_times.astype('<i8').tobytes())
+        with open(self._file("sources.txt"), 'a') as f:
+            f.truncate(sum(len(s.encode()) + 1 for s in self.sources))
+            f.writelines(s + "\n" for s in sources)
+
+        #Commit
+        self.header['n_frames'] = len(self) + n
+        fd, tmp_name = tempfile.mkstemp(dir=self.path, suffix=".json")
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.header, f, indent=4)
+        os.replace(tmp_name, self._file(header_name))
+        self._open()
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _open(self):
+        """(Re)map the committed frames"""
+        n = len(self)
+        if n:
+            self.frames = np.memmap(self._file("frames.u8"), dtype=np.uint8, mode='r', shape=(n, *self.shape))
+            self.times = np.fromfile(self._file("times.i64"), dtype='<i8', count=n).astype(np.int64)
+            with open(self._file("sources.txt"), 'r') as f:
+                self.sources = [line.rstrip("\n") for _, line in zip(range(n), f)]
+        else:
+            self.frames = np.empty((0, *self.shape), dtype=np.uint8)
+            self.times = np.array([], dtype=np.int64)
+            self.sources = []
+
+
+def stack_frame(path: str, n_frames: int, index: int):
+    """
+    Zero-copy frame of a stack opened once per process (e.g. in a worker).
+    The stack is reopened if it doesn't have the n_frames frames of the caller's FrameStack, so a
+    stack extended since it was opened is never read through a stale mapping.
+
+    Args:
+        path: Stack directory
+        n_frames: Number of committed frames of the caller's stack (len(stack))
+        index: Frame index
+    """
+    stack = _open_stacks.get(path)
+    if stack is None or len(stack) != n_frames:
+        stack = _open_stacks[path] = FrameStack(path)
+    return stack[index]
+
+
+def build_frame_stack(file_paths: list[str], times: list, path: str, n_workers: int = 8, chunk_size: int = 64):
+    """
+    Decode the images that are newer than the last frame of the stack and append them.
+
+    Args:
+        file_paths: Image paths (e.g. from get_files_with_times)
+        times: Observation time of each image
+        path: Stack directory
+        n_workers: Decoding threads (OpenCV releases the GIL)
+        chunk_size: Frames decoded and appended at a time
+
+    Returns:
+        FrameStack
+    """
+    stack = FrameStack(path)
+    last_time = stack.last_time()
+    order = sorted(range(len(file_paths)), key=lambda i: times[i])
+    epoch_times = to_epoch_us(times) if len(times) else np.array([], dtype=np.int64)
+    new = [i for i in order if last_time is None or epoch_times[i] > last_time]
+
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        for start in range(0, len(new), chunk_size):
+            chunk = new[start:start + chunk_size]
+            gray_frames = list(pool.map(lambda i: load_frame(file_paths[i])[1], chunk))
+            stack.append(gray_frames, [times[i] for i in chunk], [file_paths[i] for i in chunk])
+    return stack
@@ -1,27 +1,77 @@
 import cv2
 import numpy as np
 
+from utils.profiling import instrument
+
 '''
 This utility is responsible for preprocessing the images for feature detection.
     functions:
-        - detect sunspots
+        - detect sunspots (and its stages: decode, disk mask, blur, threshold/contours, area filter,
+          so that sweeps can share the stages between parameter values)
         - detect solar center and radius
+        - estimate solar center and radius from the previous frame (SolarDiskEstimator)
 '''
 
-def detect_sunspots(image_path, sunspot_threshold=25, min_area=16, kernel_size = 3):
+@instrument()
+def detect_sunspots(image_path, sunspot_threshold=25, min_area=16, kernel_size = 3, disk_estimator = None):
+    img, gray_img = load_frame(image_path)
+    centroids, solar_center, solar_radius = detect_sunspots_gray(gray_img, sunspot_threshold, min_area, kernel_size, disk_estimator)
+    return img, centroids, solar_center, solar_radius
+
+
+def detect_sunspots_gray(gray_img, sunspot_threshold=25, min_area=16, kernel_size = 3, disk_estimator = None):
+    """Same as detect_sunspots on an already decoded grayscale frame (e.g. a FrameStack slice)"""
+    # 1. Find solar disk (reusing the previous frame's geometry if an estimator is given)
+    solar_center, solar_radius, mask = solar_disk_mask(gray_img, disk_estimator)
+    
+    # 3. Sunspot-specific processing
+    blurred = blur_frame(gray_img, kernel_size)
+    centroids = find_sunspots(blurred, mask, sunspot_threshold, min_area)
+    
+    return centroids, solar_center, solar_radius
+
+
+@instrument()
+def load_frame(image_path):
+    """Decoded BGR image and its grayscale version"""
     img = cv2.imread(image_path)
     gray_img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    
-    # 1. Find solar disk
-    solar_center, solar_radius = detect_solar_threshold(gray_img)
+    return img, gray_img
+
+
+@instrument()
+def solar_disk_mask(gray_img, disk_estimator = None):
+    """Solar center, radius and the mask of the disk (95% radius)"""
+    if disk_estimator is not None:
+        solar_center, solar_radius = disk_estimator.estimate(gray_img)
+    else:
+        solar_center, solar_radius = detect_solar_threshold(gray_img)
     
     # 2. Create solar mask (95% radius)
     mask = np.zeros_like(gray_img)
     cv2.circle(mask, solar_center, int(solar_radius * 0.95), 255, -1)
+    return solar_center, solar_radius, mask
+
+
+@instrument()
+def blur_frame(gray_img, kernel_size = 3):
+    return cv2.GaussianBlur(gray_img, (kernel_size, kernel_size), 0)
+
+
+def find_sunspots(blurred, mask, sunspot_threshold=25, min_area=16):
+    """Centroids of the sunspots of a blurred frame"""
+    return filter_sunspots(*sunspot_candidates(blurred, mask, sunspot_threshold), min_area)
+
+
+@instrument()
+def sunspot_candidates(blurred, mask, sunspot_threshold=25):
+    """
+    Contours of the thresholded frame before the area filter.
     
-    # 3. Sunspot-specific processing
-    blurred = cv2.GaussianBlur(gray_img, (kernel_size, kernel_size), 0)
-    
+    Returns:
+        areas: Area of every contour
+        contours: The contours
+    """
     # Focused adaptive thresholding
     sunspots = cv2.adaptiveThreshold(blurred, 255,
                                     cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
@@ -34,26 +84,173 @@ def detect_sunspots(image_path, sunspot_threshold=25, min_area=16, kernel_size =
     kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3,3))
     cleaned = cv2.morphologyEx(sunspots, cv2.MORPH_OPEN, kernel)
     
-    # Find and filter contours
+    # Find contours
     contours, _ = cv2.findContours(cleaned, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
-    
+    areas = [cv2.contourArea(cnt) for cnt in contours]
+    return areas, contours
+
+
+@instrument()
+def filter_sunspots(areas, contours, min_area=16):
+    """Centroids of the contours larger than min_area"""
     centroids = []
-    for cnt in contours:
-        if cv2.contourArea(cnt) > min_area:
+    for area, cnt in zip(areas, contours):
+        if area > min_area:
             M = cv2.moments(cnt)
             cx = int(M['m10']/M['m00'])
             cy = int(M['m01']/M['m00'])
             centroids.append((cx, cy))
-    
-    return img, centroids, solar_center, solar_radius
+    return centroids
 
 
+@instrument()
 def detect_solar_threshold(gray_img):
+    cx, cy, radius = solar_circle(gray_img)
+    solar_center = (int(cx), int(cy))
+    solar_radius = int(radius)
+    return solar_center, solar_radius
+
+
+@instrument()
+def solar_circle(gray_img):
+    """Enclosing circle (cx, cy, radius) of the solar disk, before the pixel truncation of detect_solar_threshold"""
     _, solar_thresh = cv2.threshold(gray_img, 200, 255, cv2.THRESH_BINARY)
     contours, _ = cv2.findContours(solar_thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
     solar_contour = max(contours, key=cv2.contourArea)
     (cx, cy), radius = cv2.minEnclosingCircle(solar_contour)
-    solar_center = (int(cx), int(cy))
-    solar_radius = int(radius)
-    return solar_center, solar_radius
+    return cx, cy, radius
+
+
+
+class SolarDiskEstimator:
+    def __init__(self, n_rays=64, search_width=6, max_drift_px=3, max_residual_px=1.0, min_valid_rays=0.9, edge_level=100,
+                 truncation_margin_px=0.3):
+        """
+        Disk geometry estimator that reuses the previous frame's center and radius.
+        Instead of contouring the whole image, the limb is only sampled along n_rays short rays
+        around the previous circle and a circle is fitted to the edge points. If the limb moved
+        less than max_drift_px, the unrounded reference circle is shifted by the measured drift and
+        truncated like detect_solar_threshold. Otherwise, or if the fit is poor (e.g. eclipse, bad
+        frame), it falls back to detect_solar_threshold (a drift fallback).
+        A shifted value within truncation_margin_px of a pixel boundary could truncate either way
+        (the limb fit is only good to a few tenths of a pixel). It then keeps the previous frame's
+        integer value if that is one of the two candidates (sub-pixel drift), and only falls back
+        (a rounding fallback) if the drift may really have crossed the boundary.
+        
+        n_rays: Number of rays sampled around the limb
+        search_width: Half width (px) of the band around the previous radius that is sampled
+        max_drift_px: Maximum center/radius change (px) accepted without a full detection
+        max_residual_px: Maximum rms distance (px) of the edge points from the fitted circle
+        min_valid_rays: Minimum fraction of rays that must cross the limb inside the band
+        edge_level: Gray level of the disk/background edge
+        truncation_margin_px: Limb fit noise (px) within which a truncation is ambiguous
+        """
+        self.n_rays = n_rays
+        self.search_width = search_width
+        self.max_drift = max_drift_px
+        self.max_residual = max_residual_px
+        self.min_valid_rays = min_valid_rays
+        self.edge_level = edge_level
+        self.truncation_margin = truncation_margin_px
+        
+        angles = np.linspace(0, 2 * np.pi, n_rays, endpoint=False)
+        self._cos = np.cos(angles)[:, None]
+        self._sin = np.sin(angles)[:, None]
+        self._offsets = np.arange(-search_width, search_width + 0.5, 0.5)[None, :]
+        
+        self.reset()
+
+    def reset(self):
+        self.solar_center = None
+        self.solar_radius = None
+        self._reference_fit = None  # Limb fit (cx, cy, r) of the last full detection
+        self._reference_circle = None  # Unrounded (cx, cy, r) of the last full detection
+        self.n_frames = 0
+        self.n_fallbacks = 0
+        self.n_rounding_fallbacks = 0  # Part of n_fallbacks due to an ambiguous truncation
+        self.last_fallback = False
+
+    @property
+    def fallback_rate(self):
+        """Fraction of the frames that needed a full detection"""
+        return self.n_fallbacks / self.n_frames if self.n_frames else 0.0
+
+    @property
+    def rounding_fallback_rate(self):
+        """Fraction of the frames that needed a full detection because of an ambiguous truncation"""
+        return self.n_rounding_fallbacks / self.n_frames if self.n_frames else 0.0
+
+    def record(self, fell_back):
+        """Count a frame estimated elsewhere (e.g. in a worker process)"""
+        self.n_frames += 1
+        self.n_fallbacks += int(fell_back)
+
+    @instrument()
+    def estimate(self, gray_img):
+        """Return (solar_center, solar_radius) like detect_solar_threshold"""
+        self.n_frames += 1
+        self.last_fallback = False
+        
+        fit = None
+        if self._reference_fit is not None:
+            fit = self._fit_limb(gray_img, *self._reference_fit)
+            if fit is not None:
+                #Drift check against the reference fit
+                shift = np.subtract(fit, self._reference_fit)
+                if np.all(np.abs(shift) <= self.max_drift):
+                    #Shift the unrounded reference and truncate like detect_solar_threshold
+                    circle = np.add(self._reference_circle, shift)
+                    low = np.floor(circle - self.truncation_margin)
+                    high = np.floor(circle + self.truncation_margin)
+                    previous = np.array([*self.solar_center, self.solar_radius])
+                    #Unambiguous values are truncated, ambiguous ones keep the previous integer if it is a candidate
+                    geometry = np.where(low == high, low, previous)
+                    if np.all((low == high) | (previous == low) | (previous == high)):
+                        cx, cy, radius = (int(v) for v in geometry)
+                        self.solar_center = (cx, cy)
+                        self.solar_radius = radius
+                        return self.solar_center, self.solar_radius
+                    self.n_rounding_fallbacks += 1
+        
+        #Full detection, which becomes the new reference
+        self.n_fallbacks += 1
+        self.last_fallback = True
+        self._reference_circle = solar_circle(gray_img)
+        cx, cy, radius = self._reference_circle
+        self.solar_center, self.solar_radius = (int(cx), int(cy)), int(radius)
+        #The limb fit of this frame (if any) is still valid as the new reference
+        self._reference_fit = fit if fit is not None else self._fit_limb(gray_img, *self.solar_center, self.solar_radius)
+        return self.solar_center, self.solar_radius
 
+    def _fit_limb(self, gray_img, cx, cy, radius):
+        """Least-squares circle (cx, cy, r) through the limb points found along the rays, or None"""
+        radii = radius + self._offsets
+        map_x = (cx + radii * self._cos).astype(np.float32)
+        map_y = (cy + radii * self._sin).astype(np.float32)
+        samples = cv2.remap(gray_img, map_x, map_y, cv2.INTER_LINEAR).astype(np.float32)
+        
+        #A ray is valid if it starts on the disk and ends on the background
+        inside = samples > self.edge_level
+        valid = inside[:, 0] & ~inside[:, -1]
+        if valid.mean() < self.min_valid_rays:
+            return None
+        samples, inside, radii_valid = samples[valid], inside[valid], np.broadcast_to(radii, (len(valid), radii.shape[1]))[valid]
+        
+        #Sub-pixel edge between the last sample on the disk and the first one off it
+        rows = np.arange(len(samples))
+        j = np.argmin(inside, axis=1)
+        v_in, v_out = samples[rows, j - 1], samples[rows, j]
+        frac = (v_in - self.edge_level) / np.maximum(v_in - v_out, 1e-6)
+        r_edge = radii_valid[rows, j - 1] + frac * 0.5
+        x = cx + r_edge * self._cos[valid, 0]
+        y = cy + r_edge * self._sin[valid, 0]
+        
+        #Algebraic (Kasa) circle fit: x^2 + y^2 = a*x + b*y + c
+        A = np.column_stack([x, y, np.ones_like(x)])
+        (a, b, c), *_ = np.linalg.lstsq(A, x**2 + y**2, rcond=None)
+        fit_cx, fit_cy = a / 2, b / 2
+        fit_r = np.sqrt(c + fit_cx**2 + fit_cy**2)
+        residual = np.sqrt(np.mean((np.hypot(x - fit_cx, y - fit_cy) - fit_r) ** 2))
+        if residual > self.max_residual:
+            return None
+        return fit_cx, fit_cy, fit_r
@@ -0,0 +1,121 @@
+import os
+import tempfile
+from datetime import datetime, timedelta, timezone
+import numpy as np
+
+from utils.data import fetch_images, default_url, default_save_dir
+from utils.catalog import FrameCatalog
+from utils.feature_tracking import SunspotTracker
+from utils.pipeline import detect_frames
+from utils.track_archive import TrackArchive
+from utils.track_store import to_epoch_us, from_epoch_us, concat_columns
+
+'''
+This utility keeps a track archive (utils/track_archive.py) up to date incrementally.
+Every run only fetches, detects and tracks the frames newer than the last processed one,
+then appends the tracks that finished to the archive. The tracker itself is checkpointed
+next to the archive (checkpoint.npz), so the tracks that are still live at the end of a run
+are continued by the next run instead of being cut in two:
+    last_time: Time of the last processed frame (int64 us since the epoch)
+    archive_parts: Number of archive parts written when the checkpoint was taken
+    ...: The tracker state (see SunspotTracker.get_state)
+The archive part is written before the checkpoint, so a part left by a run that crashed in
+between is dropped on the next run and its frames are processed again.
+'''
+
+checkpoint_name = "checkpoint.npz"
+
+
+def load_checkpoint(archive_path: str):
+    """Checkpoint of an archive as a dict, or None if there is none yet"""
+    path = os.path.join(archive_path, checkpoint_name)
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as checkpoint:
+        return {name: checkpoint[name] for name in checkpoint.files}
+
+
+def save_checkpoint(archive_path: str, last_time, archive_parts, tracker: SunspotTracker = None):
+    """Atomically write the checkpoint of an archive"""
+    os.makedirs(archive_path, exist_ok=True)
+    state = tracker.get_state() if tracker is not None else {}
+    fd, tmp_name = tempfile.mkstemp(dir=archive_path, suffix=".npz")
+    with os.fdopen(fd, 'wb') as f:
+        np.savez(f, last_time=np.int64(last_time), archive_parts=np.int64(archive_parts), **state)
+    os.replace(tmp_name, os.path.join(archive_path, checkpoint_name))
+
+
+def update_archive(archive_path: str, save_dir: str = default_save_dir, start_date: datetime = None,
+                   end_date: datetime = None, data_bank_url: str = default_url,
+                   cadence: timedelta = timedelta(hours=1.5), fetch: bool = True, finish: bool = False,
+                   max_angular_speed=1, n_workers: int = None, cache=None, disk_estimator=None, **detect_kwargs):
+    """
+    Process the frames that are newer than the last run and append the finished tracks to the archive.
+
+    Args:
+        archive_path: Track archive directory (the checkpoint is stored there)
+        save_dir: Root directory of the images
+        start_date: First frame of the very first run (later runs resume after the checkpoint)
+        end_date: End of the frames to process (excluded), default now (UTC)
+        data_bank_url, cadence: Passed on to fetch_images
+        fetch: Download the new frames first
+        finish: Also retire the tracks that are still live (e.g. at the end of a campaign)
+        max_angular_speed: Passed on to the SunspotTracker of the first run
+        n_workers, cache, disk_estimator, **detect_kwargs: Passed on to detect_frames
+
+    Returns:
+        dict: Number of processed 'frames', appended 'tracks' and 'rows', and the 'last_time' (datetime)
+    """
+    archive = TrackArchive(archive_path)
+    checkpoint = load_checkpoint(archive_path)
+    tracker = None
+    finished = []  # Columns of every track retired during this run
+    if checkpoint is not None:
+        archive.truncate(int(checkpoint['archive_parts']))
+        last_time = int(checkpoint['last_time'])
+        if 'next_track_id' in checkpoint:
+            tracker = SunspotTracker.from_state(checkpoint, on_track_finished=finished.append)
+            tracker.streaming = True
+    elif archive.parts:
+        #Archive written by save_tracks: resume after its last observation
+        last_time = archive.time_range()[1]
+    else:
+        if start_date is None:
+            raise ValueError("start_date is required for the first run of an archive")
+        last_time = None
+
+    end_date = end_date or datetime.now(timezone.utc).replace(tzinfo=None)
+    if fetch:
+        fetch_start = from_epoch_us(last_time) + cadence if last_time is not None else start_date
+        if fetch_start < end_date:
+            fetch_images(data_bank_url, save_dir, fetch_start, end_date, cadence)
+
+    #Only the frames after the checkpoint
+    first = from_epoch_us(last_time + 1) if last_time is not None else start_date
+    file_paths, times = FrameCatalog(save_dir).range(first, end_date)
+    summary = {'frames': len(file_paths), 'tracks': 0, 'rows': 0, 'last_time': from_epoch_us(last_time) if last_time is not None else None}
+    if not file_paths and not finish:
+        return summary
+
+    frames = detect_frames(file_paths, times, n_workers,
+                           cache=cache, disk_estimator=disk_estimator, **detect_kwargs)
+    for time, _, centroids, solar_center, solar_radius in frames:
+        if tracker is None:
+            #Initial value for solar center and radius from the first image, ids continue the archive's
+            tracker = SunspotTracker(solar_center, solar_radius, max_angular_speed, streaming=True,
+                                     on_track_finished=finished.append)
+            tracker.store.next_track_id = archive.next_track_id()
+        tracker.process_frame(time, centroids)
+        last_time = int(to_epoch_us(time))
+
+    if finish and tracker is not None:
+        tracker.finish()
+    if finished:
+        columns = concat_columns(*finished)
+        archive.append(columns)
+        summary['tracks'] = len(finished)
+        summary['rows'] = len(columns['track_id'])
+    if last_time is not None:
+        save_checkpoint(archive_path, last_time, len(archive.parts), tracker)
+        summary['last_time'] = from_epoch_us(last_time)
+    return summary
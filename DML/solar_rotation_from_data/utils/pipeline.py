@@ -0,0 +1,142 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, Future
+
+from utils.image_processing import detect_sunspots, detect_sunspots_gray, SolarDiskEstimator
+from utils.feature_tracking import SunspotTracker
+from utils.detection_cache import DetectionCache
+from utils.frame_stack import FrameStack, stack_frame
+
+'''
+This utility runs the detection -> tracking loop of the notebook as a pipeline.
+Sunspot detection is independent for every frame, so it runs in a process pool,
+while only the tracker needs the frames in order. The results are streamed back in
+timestamp order, so the tracker works on frame k while the workers detect the next ones.
+    functions:
+        - detect frames (ordered generator over the detections)
+        - track frames (feeds the detections to a SunspotTracker)
+'''
+
+
+# Per-process copy of the disk estimator (set by _init_worker)
+_worker_disk_estimator = None
+
+
+def _init_worker(disk_estimator):
+    global _worker_disk_estimator
+    _worker_disk_estimator = disk_estimator
+
+
+def _detect_frame(image_path, detect_kwargs, disk_estimator=None):
+    """Worker function: only send back the detections, not the decoded image"""
+    if isinstance(image_path, tuple):
+        #(stack path, frame count, frame index): zero-copy slice of a FrameStack instead of decoding the image
+        return detect_sunspots_gray(stack_frame(*image_path), **detect_kwargs, disk_estimator=disk_estimator)
+    _, centroids, solar_center, solar_radius = detect_sunspots(image_path, **detect_kwargs, disk_estimator=disk_estimator)
+    return centroids, solar_center, solar_radius
+
+
+def _detect_frame_in_worker(image_path, detect_kwargs):
+    """Pool version of _detect_frame, also reporting whether the worker's disk estimator fell back"""
+    result = _detect_frame(image_path, detect_kwargs, _worker_disk_estimator)
+    fell_back = _worker_disk_estimator.last_fallback if _worker_disk_estimator is not None else True
+    return result, fell_back
+
+
+def detect_frames(file_paths: list[str], times: list, n_workers: int = None, max_in_flight: int = None,
+                  cache: DetectionCache = None, disk_estimator: SolarDiskEstimator = None, stack: FrameStack = None,
+                  **detect_kwargs):
+    """
+    Detect the sunspots of every frame in a process pool.
+
+    Args:
+        file_paths: Image paths (e.g. from get_files_with_times)
+        times: Observation time of each image
+        n_workers: Number of worker processes (default: all cores, 1 runs in-process)
+        max_in_flight: Maximum number of frames submitted ahead of the consumer
+        cache: Optional DetectionCache, only the misses are detected (and saved at the end)
+        disk_estimator: Optional SolarDiskEstimator to reuse the disk geometry between frames.
+            Every worker process gets its own copy, and their fallbacks are counted on this one
+        stack: Optional FrameStack, the frames found in it (by time) are read from it instead of decoded
+        **detect_kwargs: Passed on to detect_sunspots (sunspot_threshold, min_area, kernel_size)
+
+    Yields:
+        (time, file_path, centroids, solar_center, solar_radius) in timestamp order
+    """
+    order = sorted(range(len(file_paths)), key=lambda i: times[i])
+    n_workers = n_workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or 4 * n_workers
+    pool = None
+    if n_workers > 1:
+        pool = ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker, initargs=(disk_estimator,))
+
+    def submit(i):
+        """Cached detection, pending future or (for a single worker) the detection itself"""
+        key = None
+        if cache is not None:
+            key = cache.key(file_paths[i], **detect_kwargs)
+            entry = cache.get(key)
+            if entry is not None:
+                return i, key, entry
+        index = stack.index_of(times[i]) if stack is not None else None
+        if pool is None:
+            if index is not None:
+                #In-process: read the given stack directly
+                return i, key, detect_sunspots_gray(stack[index], **detect_kwargs, disk_estimator=disk_estimator)
+            return i, key, _detect_frame(file_paths[i], detect_kwargs, disk_estimator)
+        source = file_paths[i] if index is None else (stack.path, len(stack), index)
+        return i, key, pool.submit(_detect_frame_in_worker, source, detect_kwargs)
+
+    def collect(i, key, result):
+        if isinstance(result, Future):
+            result, fell_back = result.result()
+            if disk_estimator is not None:
+                disk_estimator.record(fell_back)
+        if cache is not None and key not in cache:
+            cache.put(key, *result)
+        return (times[i], file_paths[i], *result)
+
+    #Bound the number of pending frames so memory stays flat on long archives
+    try:
+        pending = deque()
+        for i in order:
+            pending.append(submit(i))
+            if len(pending) >= max_in_flight:
+                yield collect(*pending.popleft())
+        while pending:
+            yield collect(*pending.popleft())
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+        if cache is not None:
+            cache.save()
+
+
+def track_frames(file_paths: list[str], times: list, tracker: SunspotTracker = None, max_angular_speed=1,
+                 n_workers: int = None, cache: DetectionCache = None, disk_estimator: SolarDiskEstimator = None,
+                 stack: FrameStack = None, **detect_kwargs):
+    """
+    Parallel replacement of the notebook's main feature tracking loop.
+
+    Args:
+        file_paths: Image paths (e.g. from get_files_with_times)
+        times: Observation time of each image
+        tracker: Existing SunspotTracker to feed, by default one is seeded from the first frame
+        max_angular_speed: Passed on to the new SunspotTracker
+        n_workers: Number of worker processes for the detection
+        cache: Optional DetectionCache to skip the detection of already processed images
+        disk_estimator: Optional SolarDiskEstimator to reuse the disk geometry between frames
+        stack: Optional FrameStack to read the decoded frames from
+        **detect_kwargs: Passed on to detect_sunspots
+
+    Returns:
+        SunspotTracker: The tracker after processing every frame
+    """
+    frames = detect_frames(file_paths, times, n_workers, cache=cache, disk_estimator=disk_estimator, stack=stack,
+                           **detect_kwargs)
+    for time, _, centroids, solar_center, solar_radius in frames:
+        if tracker is None:
+            #Initial value for solar center and radius from the first image
+            tracker = SunspotTracker(solar_center, solar_radius, max_angular_speed)
+        tracker.process_frame(time, centroids)
+    return tracker
@@ -0,0 +1,169 @@
+import json
+import time
+import functools
+import tracemalloc
+from contextlib import contextmanager
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+'''
+This utility is an opt-in instrumentation layer for the pipeline.
+The stages of data, image_processing, solar_geometry and feature_tracking are wrapped with
+@instrument, which records per-stage wall time, call counts and,
+optionally, the peak traced memory. Stages marked per_frame also record the latency of every frame.
+While disabled (the default) a wrapped call only costs one flag check.
+Only the current process is recorded, so profile the detection with n_workers=1.
+    usage:
+        profiling.enable(memory=True)
+        ... run the pipeline ...
+        profiling.save_report("profile.json")
+'''
+
+_enabled = False
+_memory = False
+_stats = {}  # name: [count, total_s, max_s, peak_bytes]
+_frame_latencies = []
+_memory_stack = []  # [current bytes at stage start, peak reached before the last peak reset (children included)]
+_started = None
+
+
+def enable(memory=False):
+    """Start recording (memory=True also traces the allocations, which slows Python code down)"""
+    global _enabled, _memory, _started
+    _enabled = True
+    _memory = memory
+    _started = time.perf_counter()
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def disable():
+    global _enabled, _memory
+    _enabled = False
+    if _memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _memory = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    """Drop everything recorded so far"""
+    global _started
+    _stats.clear()
+    _frame_latencies.clear()
+    _memory_stack.clear()
+    _started = time.perf_counter() if _enabled else None
+
+
+def instrument(name=None, per_frame=False):
+    """
+    Decorator recording the calls of a function as a stage.
+
+    Args:
+        name: Stage name (default: module.function)
+        per_frame: Also record every call as one frame latency (e.g. SunspotTracker.process_frame)
+    """
+    def decorator(func):
+        stage_name = name or f"{func.__module__.rsplit('.', 1)[-1]}.{func.__qualname__}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _record(stage_name, per_frame):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def _record(name, per_frame):
+    if _memory:
+        current, peak_so_far = tracemalloc.get_traced_memory()
+        #Resetting the peak would drop what the parent stage reached so far, so fold it in first
+        if _memory_stack:
+            _memory_stack[-1][1] = max(_memory_stack[-1][1], peak_so_far)
+        _memory_stack.append([current, 0])
+        tracemalloc.reset_peak()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        peak = 0
+        if _memory and _memory_stack:
+            start_bytes, child_peak = _memory_stack.pop()
+            absolute_peak = max(tracemalloc.get_traced_memory()[1], child_peak)
+            peak = absolute_peak - start_bytes
+            if _memory_stack:
+                _memory_stack[-1][1] = max(_memory_stack[-1][1], absolute_peak)
+        stats = _stats.get(name)
+        if stats is None:
+            stats = _stats[name] = [0, 0.0, 0.0, 0]
+        stats[0] += 1
+        stats[1] += elapsed
+        stats[2] = max(stats[2], elapsed)
+        stats[3] = max(stats[3], peak)
+        if per_frame:
+            _frame_latencies.append(elapsed)
+
+
+def report():
+    """
+    Machine-readable summary of everything recorded.
+
+    Returns:
+        dict: 'wall_time_s' since enable, 'stages' (count, total_s, mean_s, max_s, share of the wall
+        time and peak_memory_bytes), 'frames' latency statistics and 'memory' peaks
+    """
+    wall = time.perf_counter() - _started if _started is not None else 0.0
+    stages = {}
+    for name, (count, total, longest, peak) in sorted(_stats.items(), key=lambda item: -item[1][1]):
+        stages[name] = {
+            'count': count,
+            'total_s': total,
+            'mean_s': total / count,
+            'max_s': longest,
+            'share': total / wall if wall else None,
+            'peak_memory_bytes': peak if _memory else None,
+        }
+
+    latencies = np.array(_frame_latencies)
+    frames = {'count': len(latencies)}
+    if len(latencies):
+        frames.update({
+            'mean_s': float(latencies.mean()),
+            'p50_s': float(np.percentile(latencies, 50)),
+            'p95_s': float(np.percentile(latencies, 95)),
+            'max_s': float(latencies.max()),
+        })
+
+    memory = {'traced_peak_bytes': tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else None}
+    if resource is not None:
+        #ru_maxrss is in KiB on Linux (bytes on macOS)
+        memory['max_rss_kib'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {'wall_time_s': wall, 'stages': stages, 'frames': frames, 'memory': memory}
+
+
+def save_report(path="profile.json"):
+    with open(path, 'w') as f:
+        json.dump(report(), f, indent=4)
+
+
+def print_report():
+    """Table of the stages, slowest first"""
+    summary = report()
+    print(f"{'stage':<50}{'calls':>8}{'total (s)':>12}{'mean (ms)':>12}{'share':>8}")
+    for name, s in summary['stages'].items():
+        share = f"{100 * s['share']:.1f}%" if s['share'] is not None else ""
+        print(f"{name:<50}{s['count']:>8}{s['total_s']:>12.3f}{1000 * s['mean_s']:>12.3f}{share:>8}")
+    if summary['frames']['count']:
+        f = summary['frames']
+        print(f"frames: {f['count']}, mean {1000 * f['mean_s']:.2f} ms, p95 {1000 * f['p95_s']:.2f} ms")
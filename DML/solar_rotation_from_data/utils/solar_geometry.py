@@ -1,10 +1,125 @@
 # utils/solar_geometry.py
 from sunpy.coordinates import sun, frames
 from astropy.coordinates import SkyCoord
+from astropy.time import Time
 import astropy.units as u
 import numpy as np
 from datetime import datetime
+from collections import OrderedDict, namedtuple
 
+from utils.profiling import instrument
+
+# Solar orientation parameters and heliographic frames for one observation time
+Ephemeris = namedtuple('Ephemeris', ['B0', 'L0', 'carrington', 'stonyhurst'])
+
+
+class EphemerisCache:
+    """
+    Memoized ephemeris layer keyed by observation time.
+    B0/L0 (radians) and the Carrington/Stony frames are only computed once per obstime,
+    and the least recently used entries are evicted once max_size is reached.
+    """
+    def __init__(self, max_size=4096):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, time):
+        """Return the Ephemeris for a single observation time"""
+        key = _time_key(time)
+        entry = self._entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry
+        self.misses += 1
+        return self._fill([key])[key]
+
+    def get_many(self, times):
+        """Return the B0 and L0 arrays (radians) for a sequence of observation times"""
+        keys = [_time_key(t) for t in times]
+        entries = {}
+        for key in dict.fromkeys(keys):
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                entries[key] = entry
+        missing = [k for k in dict.fromkeys(keys) if k not in entries]
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            entries.update(self._fill(missing))
+        B0 = np.array([entries[k].B0 for k in keys])
+        L0 = np.array([entries[k].L0 for k in keys])
+        return B0, L0
+
+    def precompute(self, times):
+        """Fill the cache for a whole cadence grid with a single vectorized ephemeris call"""
+        keys = list(dict.fromkeys(_time_key(t) for t in times))
+        missing = [k for k in keys if k not in self._entries]
+        if missing:
+            self._fill(missing)
+            self.misses += len(missing)
+        return len(missing)
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, time):
+        return _time_key(time) in self._entries
+
+    @instrument()
+    def _fill(self, keys):
+        """Compute the ephemerides of all keys in one vectorized call and store them"""
+        obstimes = Time(np.array(keys, dtype='datetime64[us]'))
+        B0 = sun.B0(obstimes).to_value(u.rad)
+        L0 = sun.L0(obstimes).to_value(u.rad)
+        computed = {}
+        for i, key in enumerate(keys):
+            obstime = obstimes[i]
+            computed[key] = Ephemeris(
+                B0=B0[i],
+                L0=L0[i],
+                carrington=frames.HeliographicCarrington(observer='earth', obstime=obstime),
+                stonyhurst=frames.HeliographicStonyhurst(obstime=obstime),
+            )
+            self._entries[key] = computed[key]
+            self._entries.move_to_end(key)
+        #Evict the least recently used entries
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return computed
+
+
+def _time_key(time):
+    """Hashable cache key (datetime64 in microseconds) for a datetime, datetime64 or astropy Time"""
+    if isinstance(time, Time):
+        time = time.datetime64
+    return np.datetime64(time, 'us')
+
+
+# Shared cache used by the pixel conversions below
+ephemeris_cache = EphemerisCache()
+
+
+def precompute_ephemerides(times):
+    """
+    Fill the shared ephemeris cache for every observation time of a run,
+    e.g. the cadence grid from data.generate_timestamps.
+    
+    Returns:
+        int: Number of newly computed ephemerides
+    """
+    return ephemeris_cache.precompute(times)
+
+
+@instrument()
 def pixel_to_heliographic(x, y, time, image_center, solar_radius_px):
     """
     Convert pixel coordinates to Stony heliographic coordinates.
@@ -30,9 +145,10 @@ def pixel_to_heliographic(x, y, time, image_center, solar_radius_px):
     if rho >= 1.0:  # Point is outside the Sun
         return None
 
-    # Solar orientation parameters (radians)
-    B0 = sun.B0(time).to(u.rad).value #Latitude of center disk
-    L0 = sun.L0(time).to(u.rad).value #Carrington longitude
+    # Solar orientation parameters (radians), memoized per obstime
+    ephemeris = ephemeris_cache.get(time)
+    B0 = ephemeris.B0 #Latitude of center disk
+    L0 = ephemeris.L0 #Carrington longitude
     # P = sun.P(time).to(u.rad).value #Angle between geocentric north and true solar north
     P=0 # The data is already adjusted to have the North aligned
 
@@ -51,12 +167,83 @@ def pixel_to_heliographic(x, y, time, image_center, solar_radius_px):
     
     #I was originally converting into carrington which is a rotating frame, when I needed to use
     #a static frame like stony.
-    carr = SkyCoord(phi * u.rad, psi * u.rad, frame = frames.HeliographicCarrington(observer='earth', obstime=time))
-    stony = carr.transform_to(frames.HeliographicStonyhurst(obstime=time))
+    carr = SkyCoord(phi * u.rad, psi * u.rad, frame = ephemeris.carrington)
+    stony = carr.transform_to(ephemeris.stonyhurst)
 
     return stony
 
 
+@instrument()
+def pixels_to_heliographic(pixels, times, image_center, solar_radius_px):
+    """
+    Vectorized version of pixel_to_heliographic for a whole batch of centroids.
+    The batch can be a single frame (one time for every pixel) or many frames at once
+    (one time per pixel), and only a single Carrington -> Stony transform is made for it.
+    
+    Args:
+        pixels: Array-like of shape (N, 2) with the (x, y) pixel coordinates
+        times: Observation time (datetime) of the whole batch, or a sequence of N times
+        image_center: Tuple (x_center, y_center) in pixels, or an array of shape (N, 2)
+        solar_radius_px: Solar radius in pixels (float), or an array of shape (N,)
+    
+    Returns:
+        lon, lat: NumPy arrays of Stony longitude and latitude (degrees),
+        NaN for the points outside of the solar disk
+    """
+    pixels = np.asarray(pixels, dtype=float).reshape(-1, 2)
+    n = len(pixels)
+    lon = np.full(n, np.nan)
+    lat = np.full(n, np.nan)
+    if n == 0:
+        return lon, lat
+
+    # Calculate offset from disk center
+    center = np.broadcast_to(np.asarray(image_center, dtype=float), (n, 2))
+    dx = pixels[:, 0] - center[:, 0]
+    dy = center[:, 1] - pixels[:, 1]  # Flip y-axis
+    rho = np.hypot(dx, dy) / np.broadcast_to(np.asarray(solar_radius_px, dtype=float), (n,))
+
+    on_disk = rho < 1.0  # Points outside of the sun stay NaN
+    if not on_disk.any():
+        return lon, lat
+    dx, dy, rho = dx[on_disk], dy[on_disk], rho[on_disk]
+
+    # Only evaluate the ephemeris once per distinct observation time
+    obstime = _batch_obstime(times, n)[on_disk]
+    unique_times, inverse = np.unique(obstime, return_inverse=True)
+    B0, L0 = ephemeris_cache.get_many(unique_times)
+    B0 = B0[inverse] #Latitude of center disk
+    L0 = L0[inverse] #Carrington longitude
+    unique_times = Time(unique_times)
+    P = 0 # The data is already adjusted to have the North aligned
+
+    # Position angle from solar axis
+    theta = np.arctan2(dy, dx) - P
+
+    # Same spherical projection as pixel_to_heliographic, but on whole arrays
+    cos_c = np.sqrt(1 - rho**2)
+    psi = np.arcsin(np.sin(B0) * cos_c + np.cos(B0) * rho * np.sin(theta))
+    delta_phi = np.arctan2(rho * np.cos(theta), np.cos(B0) * cos_c - np.sin(B0) * rho * np.sin(theta))
+    phi = (L0 + delta_phi) % (2 * np.pi)  # [0, 2π]
+
+    # One vectorized frame transform for the whole batch
+    obstime = unique_times[inverse]
+    carr = SkyCoord(phi * u.rad, psi * u.rad, frame=frames.HeliographicCarrington(observer='earth', obstime=obstime))
+    stony = carr.transform_to(frames.HeliographicStonyhurst(obstime=obstime))
+
+    lon[on_disk] = stony.lon.deg
+    lat[on_disk] = stony.lat.deg
+    return lon, lat
+
+
+def _batch_obstime(times, n):
+    """Broadcast a single time or a sequence of times to an array of n datetime64 values"""
+    if isinstance(times, Time):
+        times = times.datetime64
+    times = np.asarray(times, dtype='datetime64[us]')
+    return np.broadcast_to(times, (n,))
+
+
 def calculate_angular_velocity(coord1: SkyCoord, time1: datetime,
                               coord2: SkyCoord, time2: datetime) -> float:
     """
@@ -85,4 +272,47 @@ def calculate_angular_velocity(coord1: SkyCoord, time1: datetime,
     lon2 = coord2.lon.deg % 360
     delta_lon = ((lon2 - lon1 + 180) % 360) - 180  # [-180, 180]
     
-    return delta_lon / delta_days
\ No newline at end of file
+    return delta_lon / delta_days
+
+
+@instrument()
+def calculate_angular_velocities(lon1, time1, lon2, time2):
+    """
+    Vectorized version of calculate_angular_velocity.
+    
+    Args:
+        lon1, lon2: Arrays of longitudes (degrees)
+        time1, time2: Arrays of observation times (datetime64, or int64 microseconds since the epoch)
+    
+    Returns:
+        Array of longitudinal angular velocities (degrees/day), NaN where time2 <= time1
+    """
+    time1 = np.asarray(time1).astype('datetime64[us]')
+    time2 = np.asarray(time2).astype('datetime64[us]')
+    delta_days = (time2 - time1) / np.timedelta64(86400, 's')
+    
+    # Longitude difference (handle 360° wrap)
+    delta_lon = ((np.asarray(lon2) % 360 - np.asarray(lon1) % 360 + 180) % 360) - 180  # [-180, 180]
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(delta_days > 0, delta_lon / np.where(delta_days > 0, delta_days, 1), np.nan)
+
+
+
+@instrument()
+def angular_separation(lon1, lat1, lon2, lat2):
+    """
+    Vectorized great-circle separation (Vincenty formula, like SkyCoord.separation).
+    
+    Args:
+        lon1, lat1, lon2, lat2: Arrays of coordinates (degrees)
+    
+    Returns:
+        Array of angular separations (degrees)
+    """
+    lon1, lat1, lon2, lat2 = (np.radians(np.asarray(a, dtype=float)) for a in (lon1, lat1, lon2, lat2))
+    delta_lon = lon2 - lon1
+    num1 = np.cos(lat2) * np.sin(delta_lon)
+    num2 = np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(delta_lon)
+    denominator = np.sin(lat1) * np.sin(lat2) + np.cos(lat1) * np.cos(lat2) * np.cos(delta_lon)
+    return np.degrees(np.arctan2(np.hypot(num1, num2), denominator))
@@ -0,0 +1,200 @@
+import os
+import csv
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from utils.image_processing import load_frame, solar_disk_mask, blur_frame, sunspot_candidates, filter_sunspots
+from utils.frame_stack import FrameStack, stack_frame
+from utils.feature_tracking import SunspotTracker
+from utils.data import track_association
+from utils.track_store import tracks_to_columns
+from utils.analysis import track_summaries, filter_summaries, fit_differential_rotation
+
+'''
+This utility runs the whole detection -> tracking -> stitching -> fit chain of the notebook over a
+grid of parameters, sharing the work between configurations:
+    - every frame is decoded (or read from a FrameStack) and its disk found once, blurred once per
+      kernel size and thresholded once per (kernel size, threshold), the min_area values only
+      filter the same contours
+    - the tracker runs once per (detection, tracker) setting and its tracks are stitched for every
+      stitching setting
+Both stages run in a process pool, and the results are written to a CSV table.
+'''
+
+DETECTION_PARAMS = ('sunspot_threshold', 'min_area', 'kernel_size')
+TRACKER_PARAMS = ('max_angular_speed', 'limb_cutoff')
+STITCH_PARAMS = ('max_gap_hours', 'max_distance_deg')
+DEFAULTS = {
+    'sunspot_threshold': 25,
+    'min_area': 16,
+    'kernel_size': 3,
+    'max_angular_speed': 1,
+    'limb_cutoff': 0.85,
+    'max_gap_hours': 3,
+    'max_distance_deg': 5,
+}
+RESULT_COLUMNS = ('n_tracks', 'mean_length', 'n_stitched', 'mean_stitched_length', 'n_fit_tracks',
+                  'A', 'B', 'C', 'equatorial_period', 'mean_period')
+
+def parameter_grid(**axes):
+    """
+    Every combination of the given parameter values (the other parameters keep their DEFAULTS).
+    e.g. parameter_grid(sunspot_threshold=[20, 25, 30], max_angular_speed=[1, 2])
+    """
+    unknown = set(axes) - set(DEFAULTS)
+    if unknown:
+        raise ValueError(f"Unknown sweep parameters: {sorted(unknown)}")
+    names = list(axes)
+    return [{**DEFAULTS, **dict(zip(names, values))} for values in itertools.product(*(axes[n] for n in names))]
+
+
+def run_sweep(file_paths: list[str], times: list, configs, output_csv: str = "sweep_results.csv",
+              n_workers: int = None, min_velocities=4, max_std=5, stack: FrameStack = None):
+    """
+    Run every configuration of the grid.
+
+    Args:
+        file_paths: Image paths (e.g. from get_files_with_times)
+        times: Observation time of each image
+        configs: List of parameter dicts (e.g. from parameter_grid)
+        output_csv: Results table (None to skip writing it)
+        n_workers: Number of worker processes (default: all cores, 1 runs in-process)
+        min_velocities, max_std: Track filters of the fit (see utils/analysis.py)
+        stack: Optional FrameStack, the frames found in it (by time) are read from it instead of decoded
+
+    Returns:
+        list[dict]: One row per configuration, its parameters then RESULT_COLUMNS
+    """
+    configs = [{**DEFAULTS, **c} for c in configs]
+    order = sorted(range(len(file_paths)), key=lambda i: times[i])
+    file_paths = [file_paths[i] for i in order]
+    times = [times[i] for i in order]
+    n_workers = n_workers or os.cpu_count() or 1
+
+    #Group the configurations by shared stage
+    detection_keys = sorted({_key(c, DETECTION_PARAMS) for c in configs})
+    tracking_groups = {}
+    for c in configs:
+        tracking_groups.setdefault((_key(c, DETECTION_PARAMS), _key(c, TRACKER_PARAMS)), set()).add(_key(c, STITCH_PARAMS))
+
+    #Frames found in the stack are read from it instead of decoded
+    sources = list(file_paths)
+    if stack is not None:
+        for i, time in enumerate(times):
+            index = stack.index_of(time)
+            if index is not None:
+                sources[i] = (stack.path, len(stack), index)
+
+    pool = ProcessPoolExecutor(max_workers=n_workers) if n_workers > 1 else None
+    try:
+        #1. Detection: one pass over the frames for every detection setting
+        if pool is None:
+            #In-process: read the given stack directly
+            frames = [_detect_frame_grid(stack[s[2]] if isinstance(s, tuple) else s, detection_keys) for s in sources]
+        else:
+            chunksize = max(1, len(file_paths) // (4 * n_workers))
+            frames = list(pool.map(_detect_frame_grid, sources, [detection_keys] * len(sources), chunksize=chunksize))
+        centers = [f[0] for f in frames]
+        radii = [f[1] for f in frames]
+
+        #2. Tracking and stitching: one task per (detection, tracker) setting
+        tasks = []
+        for (detection_key, tracker_key), stitch_keys in tracking_groups.items():
+            centroids = [f[2][detection_key] for f in frames]
+            tasks.append((times, centers[0], radii[0], centroids, tracker_key, sorted(stitch_keys), min_velocities, max_std))
+        if pool is None:
+            outputs = [_track_config(*task) for task in tasks]
+        else:
+            outputs = list(pool.map(_track_config, *zip(*tasks)))
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    results = {}
+    for ((detection_key, tracker_key), _), output in zip(tracking_groups.items(), outputs):
+        for stitch_key, values in output.items():
+            results[(detection_key, tracker_key, stitch_key)] = values
+
+    rows = []
+    for c in configs:
+        values = results[(_key(c, DETECTION_PARAMS), _key(c, TRACKER_PARAMS), _key(c, STITCH_PARAMS))]
+        rows.append({**{name: c[name] for name in DEFAULTS}, **values})
+    if output_csv is not None:
+        write_results(rows, output_csv)
+    return rows
+
+
+def write_results(rows, output_csv: str):
+    with open(output_csv, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(DEFAULTS) + list(RESULT_COLUMNS))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def _key(config, names):
+    return tuple(config[name] for name in names)
+
+
+def _detect_frame_grid(source, detection_keys):
+    """
+    Worker function: detections of one frame for every (sunspot_threshold, min_area, kernel_size).
+
+    Args:
+        source: Image path, decoded gray frame, or (stack path, frame count, frame index) of a FrameStack frame
+
+    Returns:
+        solar_center, solar_radius, {detection_key: centroids}
+    """
+    if isinstance(source, tuple):
+        gray_img = stack_frame(*source)
+    elif isinstance(source, np.ndarray):
+        gray_img = source
+    else:
+        _, gray_img = load_frame(source)
+    solar_center, solar_radius, mask = solar_disk_mask(gray_img)
+    detections = {}
+    blurred, candidates = {}, {}
+    for key in detection_keys:
+        sunspot_threshold, min_area, kernel_size = key
+        if kernel_size not in blurred:
+            blurred[kernel_size] = blur_frame(gray_img, kernel_size)
+        if (kernel_size, sunspot_threshold) not in candidates:
+            candidates[(kernel_size, sunspot_threshold)] = sunspot_candidates(blurred[kernel_size], mask, sunspot_threshold)
+        detections[key] = filter_sunspots(*candidates[(kernel_size, sunspot_threshold)], min_area)
+    return solar_center, solar_radius, detections
+
+
+def _track_config(times, solar_center, solar_radius, centroids, tracker_key, stitch_keys, min_velocities, max_std):
+    """Worker function: track one detection setting, then stitch and fit for every stitching setting"""
+    max_angular_speed, limb_cutoff = tracker_key
+    tracker = SunspotTracker(solar_center, solar_radius, max_angular_speed, limb_cutoff=limb_cutoff)
+    for time, frame_centroids in zip(times, centroids):
+        tracker.process_frame(time, frame_centroids)
+
+    #Same track filter as the notebook
+    data = [t for t in tracker.tracks if len(t['velocities']) >= 1]
+    base = {
+        'n_tracks': len(data),
+        'mean_length': np.mean([len(t['velocities']) for t in data]) if data else np.nan,
+    }
+
+    output = {}
+    for stitch_key in stitch_keys:
+        max_gap_hours, max_distance_deg = stitch_key
+        stitched = track_association(data, max_gap_hours, max_distance_deg)
+        values = dict(base, n_stitched=len(stitched),
+                      mean_stitched_length=np.mean([len(t['positions_px']) for t in stitched]) if stitched else np.nan,
+                      n_fit_tracks=0, A=np.nan, B=np.nan, C=np.nan, equatorial_period=np.nan, mean_period=np.nan)
+        if stitched:
+            summaries = filter_summaries(track_summaries(tracks_to_columns(stitched), min_velocities), max_std)
+            values['n_fit_tracks'] = len(summaries['track_id'])
+            if values['n_fit_tracks']:
+                values['mean_period'] = float(np.mean(summaries['mean_period']))
+            #Three parameters need at least three tracks
+            if values['n_fit_tracks'] >= 3:
+                (A, B, C), _ = fit_differential_rotation(summaries['median_latitude'], summaries['mean_period'],
+                                                         summaries['mean_error'])
+                values.update(A=A, B=B, C=C, equatorial_period=360 / A)
+        output[stitch_key] = values
+    return output
@@ -0,0 +1,141 @@
+import os
+from datetime import datetime, timedelta
+import numpy as np
+import cv2
+
+from utils.solar_geometry import ephemeris_cache
+from utils.data import image_path
+
+'''
+This utility generates synthetic SDO/HMI-like frames with a known ground truth, for benchmarks
+and for checking the pipeline end to end.
+The spots sit at a fixed latitude and rotate in Stony longitude with the differential rotation
+    omega(lat) = A + B sin^2(lat) + C sin^4(lat) (deg/day)
+and are drawn with the same orthographic projection (with the real B0 of every frame) that
+pixel_to_heliographic inverts, on a limb-darkened disk shaped like the real 512 px frames.
+'''
+
+DEFAULT_ROTATION = (13.5, -2.8, -0.3)  # A, B, C (deg/day)
+
+
+class SyntheticSun:
+    def __init__(self, n_spots=50, rotation=DEFAULT_ROTATION, max_latitude=35, image_size=512,
+                 solar_center=(256, 256), solar_radius=240, spot_radius_px=4, spot_depth=90, noise=2.0, seed=0):
+        """
+        n_spots: Number of spots all around the sun (about half of them are visible at a time)
+        rotation: Ground truth (A, B, C) of the differential rotation (deg/day)
+        max_latitude: Spots are drawn uniformly in sin(latitude) within +-max_latitude (deg)
+        image_size: Width and height of the frames (px)
+        solar_center, solar_radius: Disk geometry (px)
+        spot_radius_px: Radius of a spot seen at disk center (px)
+        spot_depth: Gray level drop at the center of a spot
+        noise: Standard deviation of the gray level noise
+        seed: Seed of the spot positions and of the noise
+        """
+        self.rotation = tuple(float(c) for c in rotation)
+        self.image_size = image_size
+        self.solar_center = solar_center
+        self.solar_radius = solar_radius
+        self.spot_radius = spot_radius_px
+        self.spot_depth = spot_depth
+        self.noise = noise
+        self.rng = np.random.default_rng(seed)
+
+        #Spots at least 3 deg apart so that they never merge
+        lon, lat = [], []
+        sin_max = np.sin(np.radians(max_latitude))
+        while len(lon) < n_spots:
+            candidate_lon = self.rng.uniform(-180, 180)
+            candidate_lat = np.degrees(np.arcsin(self.rng.uniform(-sin_max, sin_max)))
+            if lon:
+                d_lon = np.radians((np.array(lon) - candidate_lon + 180) % 360 - 180)
+                cos_d = (np.sin(np.radians(lat)) * np.sin(np.radians(candidate_lat))
+                         + np.cos(np.radians(lat)) * np.cos(np.radians(candidate_lat)) * np.cos(d_lon))
+                if np.any(cos_d > np.cos(np.radians(3))):
+                    continue
+            lon.append(candidate_lon)
+            lat.append(candidate_lat)
+        self.lon0 = np.array(lon)
+        self.lat = np.array(lat)
+
+    def omega(self, lat=None):
+        """True angular velocity (deg/day) at the given latitudes (default: every spot)"""
+        A, B, C = self.rotation
+        s2 = np.sin(np.radians(self.lat if lat is None else lat)) ** 2
+        return A + B * s2 + C * s2 ** 2
+
+    def spots(self, time, start):
+        """
+        Ground truth of one frame.
+
+        Returns:
+            dict: 'spot_id', 'lon', 'lat', 'x', 'y' (float px), 'cos_c' (cosine of the distance from disk center)
+            and 'visible' of every spot
+        """
+        days = (time - start).total_seconds() / 86400
+        lon = (self.lon0 + self.omega() * days + 180) % 360 - 180
+        B0 = ephemeris_cache.get(time).B0
+        lon_r, lat_r = np.radians(lon), np.radians(self.lat)
+
+        #Orthographic projection (inverse of pixel_to_heliographic)
+        x = np.cos(lat_r) * np.sin(lon_r)
+        y = np.sin(lat_r) * np.cos(B0) - np.cos(lat_r) * np.cos(lon_r) * np.sin(B0)
+        cos_c = np.sin(lat_r) * np.sin(B0) + np.cos(lat_r) * np.cos(lon_r) * np.cos(B0)
+        return {
+            'spot_id': np.arange(len(lon)),
+            'lon': lon,
+            'lat': self.lat,
+            'x': self.solar_center[0] + self.solar_radius * x,
+            'y': self.solar_center[1] - self.solar_radius * y,
+            'cos_c': cos_c,
+            'visible': cos_c > 0,
+        }
+
+    def render(self, truth):
+        """Grayscale frame (uint8) of the ground truth of one frame"""
+        size = self.image_size
+        yy, xx = np.mgrid[0:size, 0:size].astype(np.float32)
+        rho = np.hypot(xx - self.solar_center[0], yy - self.solar_center[1]) / self.solar_radius
+        on_disk = rho < 1
+        mu = np.sqrt(np.clip(1 - rho ** 2, 0, 1))
+        img = np.where(on_disk, 203 + 9 * mu, 0).astype(np.float32)  # Limb darkening, like the HMI frames
+
+        #Foreshortened spots: the radial size shrinks with cos_c
+        for x, y, cos_c in zip(truth['x'][truth['visible']], truth['y'][truth['visible']], truth['cos_c'][truth['visible']]):
+            r = self.spot_radius
+            x0, x1 = int(max(x - 3 * r, 0)), int(min(x + 3 * r + 1, size))
+            y0, y1 = int(max(y - 3 * r, 0)), int(min(y + 3 * r + 1, size))
+            dx, dy = xx[y0:y1, x0:x1] - x, yy[y0:y1, x0:x1] - y
+            radial = np.array([x - self.solar_center[0], y - self.solar_center[1]])
+            norm = np.hypot(*radial)
+            ux, uy = (radial / norm) if norm > 0 else (1.0, 0.0)
+            along = (dx * ux + dy * uy) / max(cos_c, 0.2)
+            across = -dx * uy + dy * ux
+            img[y0:y1, x0:x1] -= self.spot_depth * np.exp(-(along ** 2 + across ** 2) / (2 * (r / 1.5) ** 2))
+
+        img += self.rng.normal(0, self.noise, img.shape).astype(np.float32) * on_disk
+        return np.clip(img, 0, 255).astype(np.uint8)
+
+    def frames(self, start: datetime, n_frames: int, cadence: timedelta = timedelta(hours=1.5)):
+        """Lazily generate (time, gray frame, ground truth) for n_frames frames"""
+        for i in range(n_frames):
+            time = start + i * cadence
+            truth = self.spots(time, start)
+            yield time, self.render(truth), truth
+
+    def write(self, save_dir: str, start: datetime, n_frames: int, cadence: timedelta = timedelta(hours=1.5)):
+        """
+        Write the frames as JPEGs in the layout of fetch_images (save_dir/YYYYMMDD/YYYYMMDD_HHMM.jpg).
+
+        Returns:
+            file_paths, times, truths
+        """
+        file_paths, times, truths = [], [], []
+        for time, gray_img, truth in self.frames(start, n_frames, cadence):
+            path = image_path(save_dir, time)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            cv2.imwrite(path, cv2.cvtColor(gray_img, cv2.COLOR_GRAY2BGR), [cv2.IMWRITE_JPEG_QUALITY, 95])
+            file_paths.append(path)
+            times.append(time)
+            truths.append(truth)
+        return file_paths, times, truths
@@ -0,0 +1,162 @@
+import os
+import json
+import shutil
+import tempfile
+import numpy as np
+
+from utils.track_store import COLUMNS, tracks_to_columns, columns_to_dicts, concat_columns, to_epoch_us
+
+'''
+This utility is the binary, columnar replacement of toJSON/fromJSON for the tracks.
+An archive is a directory:
+    manifest.json: List of the parts with their row count, time range and track id range
+    part-00000/: One .npy file per column (see utils/track_store.py for the columns)
+    part-00001/: ...
+Each column is memory-mapped on load and only the parts overlapping the requested time range
+or tracks are opened, so subsets are loaded lazily. New rows are written as a new part, so
+appending never rewrites the existing data.
+'''
+
+manifest_name = "manifest.json"
+
+
+class TrackArchive:
+    def __init__(self, path: str):
+        """
+        path: Archive directory (created on the first append)
+        """
+        self.path = path
+        self.manifest = self._load_manifest()
+
+    def __len__(self):
+        return sum(part['rows'] for part in self.manifest['parts'])
+
+    @property
+    def parts(self):
+        return self.manifest['parts']
+
+    def time_range(self):
+        """First and last observation time (int64 us since the epoch), or None if empty"""
+        if not self.parts:
+            return None
+        return min(p['t_min'] for p in self.parts), max(p['t_max'] for p in self.parts)
+
+    def next_track_id(self):
+        """First track id that isn't used in the archive yet"""
+        return max((p['track_max'] for p in self.parts), default=-1) + 1
+
+    def append(self, columns):
+        """Write the rows of a dict of columns as a new part"""
+        n = len(columns['track_id'])
+        if n == 0:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        name = f"part-{len(self.parts):05d}"
+
+        #Write the part next to the archive then rename it, so a crash never leaves half a part
+        tmp_dir = tempfile.mkdtemp(dir=self.path, prefix=".tmp-")
+        for column, dtype in COLUMNS.items():
+            np.save(os.path.join(tmp_dir, f"{column}.npy"), np.ascontiguousarray(columns[column], dtype=dtype))
+        os.replace(tmp_dir, os.path.join(self.path, name))
+
+        self.parts.append({
+            'name': name,
+            'rows': n,
+            't_min': int(np.min(columns['time'])),
+            't_max': int(np.max(columns['time'])),
+            'track_min': int(np.min(columns['track_id'])),
+            'track_max': int(np.max(columns['track_id'])),
+        })
+        self._save_manifest()
+
+    def truncate(self, n_parts):
+        """Drop the parts after the first n_parts (e.g. written by an interrupted incremental run)"""
+        for part in self.parts[n_parts:]:
+            shutil.rmtree(os.path.join(self.path, part['name']), ignore_errors=True)
+        del self.parts[n_parts:]
+        if os.path.isdir(self.path):
+            self._save_manifest()
+
+    def load(self, start=None, end=None, track_ids=None):
+        """
+        Load a subset of the archive.
+
+        Args:
+            start, end: Optional time range (datetime), both inclusive
+            track_ids: Optional sequence of track ids
+
+        Returns:
+            dict: Columns sorted by track_id then time
+        """
+        t_min = to_epoch_us(start) if start is not None else None
+        t_max = to_epoch_us(end) if end is not None else None
+        if track_ids is not None:
+            track_ids = np.asarray(track_ids, dtype=np.int64)
+
+        pieces = []
+        for part in self.parts:
+            #Skip the parts that can't contain any requested row without opening them
+            if t_min is not None and part['t_max'] < t_min:
+                continue
+            if t_max is not None and part['t_min'] > t_max:
+                continue
+            if track_ids is not None and not np.any((track_ids >= part['track_min']) & (track_ids <= part['track_max'])):
+                continue
+
+            columns = self._open_part(part['name'])
+            mask = np.ones(part['rows'], dtype=bool)
+            if t_min is not None:
+                mask &= columns['time'] >= t_min
+            if t_max is not None:
+                mask &= columns['time'] <= t_max
+            if track_ids is not None:
+                mask &= np.isin(columns['track_id'], track_ids)
+            pieces.append({name: column[mask] for name, column in columns.items()})
+
+        if not pieces:
+            return {name: np.array([], dtype=dtype) for name, dtype in COLUMNS.items()}
+        columns = concat_columns(*pieces)
+        order = np.lexsort((columns['time'], columns['track_id']))
+        return {name: column[order] for name, column in columns.items()}
+
+    def load_tracks(self, start=None, end=None, track_ids=None):
+        """Same as load, but in the list-of-dicts layout of SunspotTracker.tracks"""
+        return columns_to_dicts(self.load(start, end, track_ids))
+
+    def _open_part(self, name):
+        part_dir = os.path.join(self.path, name)
+        return {column: np.load(os.path.join(part_dir, f"{column}.npy"), mmap_mode='r') for column in COLUMNS}
+
+    def _load_manifest(self):
+        manifest_path = os.path.join(self.path, manifest_name)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r') as f:
+                return json.load(f)
+        return {'version': 1, 'columns': list(COLUMNS), 'parts': []}
+
+    def _save_manifest(self):
+        fd, tmp_name = tempfile.mkstemp(dir=self.path, suffix=".json")
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.manifest, f, indent=4)
+        os.replace(tmp_name, os.path.join(self.path, manifest_name))
+
+
+def save_tracks(tracks, path: str):
+    """
+    Write tracks to a new archive (an existing archive at path is replaced).
+
+    Args:
+        tracks: Tracks in the list-of-dicts layout, or a dict of columns (e.g. SunspotTracker.store.to_columns())
+        path: Archive directory
+    """
+    columns = tracks if isinstance(tracks, dict) else tracks_to_columns(tracks)
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    archive = TrackArchive(path)
+    archive.append(columns)
+    return archive
+
+
+def load_tracks(path: str, start=None, end=None, track_ids=None):
+    """Load the columns of an archive (optionally a time range and/or a set of tracks)"""
+    return TrackArchive(path).load(start, end, track_ids)
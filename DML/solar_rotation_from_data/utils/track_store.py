@@ -0,0 +1,190 @@
+import numpy as np
+from astropy.coordinates import SkyCoord
+from astropy.time import Time
+from sunpy.coordinates import frames
+
+'''
+This utility holds the columnar (struct-of-arrays) storage of the tracked observations.
+Every observation is one row with the columns:
+    track_id: Id of the track the observation belongs to (int64)
+    time: Observation time in microseconds since the Unix epoch (int64)
+    x, y: Pixel centroid (int32)
+    lon, lat: Stony heliographic coordinates in degrees (float64)
+    velocity: Longitudinal angular velocity (deg/day) from the previous observation of
+              the track, NaN for the first observation (float64)
+The rows are appended frame by frame, so they are sorted by time and not by track.
+'''
+
+COLUMNS = {
+    'track_id': np.int64,
+    'time': np.int64,
+    'x': np.int32,
+    'y': np.int32,
+    'lon': np.float64,
+    'lat': np.float64,
+    'velocity': np.float64,
+}
+
+
+def to_epoch_us(times):
+    """Convert a datetime (or a sequence of them) to int64 microseconds since the Unix epoch"""
+    return np.asarray(times, dtype='datetime64[us]').astype(np.int64)
+
+
+def from_epoch_us(times):
+    """Convert int64 microseconds since the Unix epoch back to a datetime (or a list of them)"""
+    values = np.asarray(times, dtype=np.int64).astype('datetime64[us]')
+    if values.ndim == 0:
+        return values.item()
+    return values.tolist()
+
+
+class TrackStore:
+    def __init__(self, capacity=1024):
+        """
+        capacity: Initial number of rows, the columns grow by doubling
+        """
+        self._columns = {name: np.empty(capacity, dtype=dtype) for name, dtype in COLUMNS.items()}
+        self.size = 0
+        self.next_track_id = 0
+        self.version = 0  # Incremented on every change, used to cache derived views
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, name):
+        """Read-only view of a column"""
+        view = self._columns[name][:self.size]
+        view.flags.writeable = False
+        return view
+
+    def new_track_ids(self, n):
+        ids = np.arange(self.next_track_id, self.next_track_id + n, dtype=np.int64)
+        self.next_track_id += n
+        return ids
+
+    def append(self, track_id, time, x, y, lon, lat, velocity):
+        """Append a batch of observations (scalars are broadcast to the batch)"""
+        track_id = np.atleast_1d(track_id)
+        n = len(track_id)
+        if n == 0:
+            return
+        self._reserve(self.size + n)
+        values = {'track_id': track_id, 'time': time, 'x': x, 'y': y, 'lon': lon, 'lat': lat, 'velocity': velocity}
+        for name, value in values.items():
+            self._columns[name][self.size:self.size + n] = value
+        self.size += n
+        self.version += 1
+
+    def _reserve(self, size):
+        capacity = len(self._columns['track_id'])
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        for name, column in self._columns.items():
+            grown = np.empty(capacity, dtype=column.dtype)
+            grown[:self.size] = column[:self.size]
+            self._columns[name] = grown
+
+    def extend(self, columns):
+        """Append rows given as a dict of columns (e.g. from to_columns or pop_tracks)"""
+        self.append(*(columns[name] for name in COLUMNS))
+
+    def pop_tracks(self, track_ids):
+        """
+        Remove every observation of the given tracks from the store.
+        The remaining rows are compacted in place, so the store only holds what is left.
+        
+        Returns:
+            dict: Columns of the removed observations, sorted by track_id then time
+        """
+        if len(track_ids) == 0 or self.size == 0:
+            return {name: np.array([], dtype=dtype) for name, dtype in COLUMNS.items()}
+        mask = np.isin(self['track_id'], track_ids)
+        popped = {name: self[name][mask] for name in COLUMNS}
+        keep = np.flatnonzero(~mask)
+        for name, column in self._columns.items():
+            column[:len(keep)] = column[keep]
+        self.size = len(keep)
+        self.version += 1
+        order = np.lexsort((popped['time'], popped['track_id']))
+        return {name: column[order] for name, column in popped.items()}
+
+    def to_columns(self):
+        """Copy of all the columns, sorted by track_id then time"""
+        order = np.lexsort((self['time'], self['track_id']))
+        return {name: self[name][order] for name in COLUMNS}
+
+    def to_dicts(self):
+        """
+        Materialize the tracks in the list-of-dicts layout of SunspotTracker.tracks:
+        {'positions_px': [tuple], 'positions_helio': [SkyCoord], 'times': [datetime], 'velocities': [float]}
+        """
+        return columns_to_dicts(self.to_columns())
+
+
+def columns_to_dicts(columns):
+    """Build the list-of-dicts layout from track columns sorted by track_id then time"""
+    n = len(columns['track_id'])
+    if n == 0:
+        return []
+    times = from_epoch_us(columns['time'])
+
+    #One vectorized SkyCoord for every observation, indexed per point afterwards
+    obstime = Time(columns['time'].astype('datetime64[us]'))
+    coords = SkyCoord(columns['lon'], columns['lat'], unit='deg', frame=frames.HeliographicStonyhurst(obstime=obstime))
+
+    starts = np.flatnonzero(np.r_[True, columns['track_id'][1:] != columns['track_id'][:-1]])
+    ends = np.r_[starts[1:], n]
+    tracks = []
+    for start, end in zip(starts, ends):
+        tracks.append({
+            'positions_px': [(int(x), int(y)) for x, y in zip(columns['x'][start:end], columns['y'][start:end])],
+            'positions_helio': [coords[i] for i in range(start, end)],
+            'times': times[start:end],
+            'velocities': columns['velocity'][start + 1:end].tolist(),
+        })
+    return tracks
+
+
+def concat_columns(*columns):
+    """Concatenate several dicts of track columns"""
+    return {name: np.concatenate([c[name] for c in columns]).astype(dtype) for name, dtype in COLUMNS.items()}
+
+
+def split_tracks(columns):
+    """Split track columns sorted by track_id into one dict of columns per track"""
+    n = len(columns['track_id'])
+    starts = np.flatnonzero(np.r_[True, columns['track_id'][1:] != columns['track_id'][:-1]]) if n else []
+    ends = np.r_[starts[1:], n] if n else []
+    return [{name: column[start:end] for name, column in columns.items()} for start, end in zip(starts, ends)]
+
+
+def tracks_to_columns(tracks):
+    """
+    Flatten tracks in the list-of-dicts layout (with SkyCoord/datetime values, or the dict/str values
+    of the JSON files) into columns sorted by track_id then time. The track id is the list index.
+    """
+    n_points = [len(t['times']) for t in tracks]
+    n = sum(n_points)
+    columns = {name: np.empty(n, dtype=dtype) for name, dtype in COLUMNS.items()}
+    columns['track_id'][:] = np.repeat(np.arange(len(tracks), dtype=np.int64), n_points)
+    columns['time'][:] = to_epoch_us([t for track in tracks for t in track['times']])
+    
+    positions = np.array([p for track in tracks for p in track['positions_px']], dtype=np.int32).reshape(-1, 2)
+    columns['x'][:], columns['y'][:] = positions[:, 0], positions[:, 1]
+    
+    coords = [c for track in tracks for c in track['positions_helio']]
+    columns['lon'][:] = [c['lon'] if isinstance(c, dict) else c.lon.deg for c in coords]
+    columns['lat'][:] = [c['lat'] if isinstance(c, dict) else c.lat.deg for c in coords]
+    
+    #The velocity of a row is the one from the previous point of the track
+    start = 0
+    for track, count in zip(tracks, n_points):
+        velocities = np.full(count, np.nan)
+        v = np.asarray(track.get('velocities', []), dtype=float)[:count - 1]
+        velocities[1:1 + len(v)] = v
+        columns['velocity'][start:start + count] = velocities
+        start += count
+    return columns
@@ -1,48 +1,114 @@
 import os
 from ipywidgets import interact, Dropdown
 import matplotlib.pyplot as plt
+from matplotlib.collections import PathCollection
+from matplotlib.textpath import TextPath
+from matplotlib.transforms import Affine2D
 import cv2
 
-from utils.image_processing import detect_sunspots
-
-def show_sunspot_images(file_paths: list[str] = None, data: list[dict] = None):
-    
-    #Get the days 
-    day_dirs = []
-    for path in file_paths:
-        day = path.split('/')[1]
-        if day not in day_dirs:
-            day_dirs.append(day)
-            
+from utils.detection_cache import DetectionCache
+from utils.catalog import FrameCatalog
+from utils.frame_stack import FrameStack
+from utils.track_store import to_epoch_us
+
+def show_sunspot_images(file_paths: list[str] = None, data: list[dict] = None, cache: DetectionCache = None,
+                        catalog: FrameCatalog = None, stack: FrameStack = None):
+
+    #Reuse detections between dropdown changes (and between runs if a persistent cache is given)
+    if cache is None:
+        cache = DetectionCache(path=None)
+
+    #Get the days (per-day lookups come from the frame catalog instead of scanning every path),
+    #restricted to the given file_paths if any
+    if catalog is None:
+        if not file_paths:
+            raise ValueError("show_sunspot_images needs file_paths or a catalog")
+        catalog = FrameCatalog(os.path.dirname(os.path.dirname(file_paths[0])))
+    selected = {os.path.normpath(p) for p in file_paths} if file_paths else None
+    if selected is None:
+        day_dirs = catalog.days
+    else:
+        day_dirs = sorted({os.path.basename(os.path.dirname(p)) for p in selected})
+
+    #(frame time, x, y) -> track labels, built once instead of searching every track for every centroid
+    labels = TrackLabelIndex(data) if data else None
+
     @interact(day=Dropdown(options=day_dirs, description="Select Day:"))
     def show_day_images(day):
-        files = sorted([f for f in file_paths if day in f])[:16] #only the first 16 images
-        
+        files, times = catalog.day(day)
+        if selected is not None:
+            keep = [i for i, f in enumerate(files) if os.path.normpath(f) in selected]
+            files, times = [files[i] for i in keep], [times[i] for i in keep]
+        files, times = files[:16], times[:16] #only the first 16 images
+
         fig, axes = plt.subplots(3, 4, figsize=(15, 10))
-        for ax, file in zip(axes.flat, files):
-            img, centroids, _, _ = detect_sunspots(file)
-            print(centroids)
-            
-            ax.imshow(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+        for ax, file, time in zip(axes.flat, files, times):
+            centroids, _, _ = cache.detect(file)
+
+            #Zero-copy frame from the stack if it has it, otherwise decode the image
+            index = stack.index_of(time) if stack is not None else None
+            if index is not None:
+                ax.imshow(stack[index], cmap='gray', vmin=0, vmax=255)
+            else:
+                ax.imshow(cv2.cvtColor(cv2.imread(file), cv2.COLOR_BGR2RGB))
             ax.scatter([c[0] for c in centroids], [c[1] for c in centroids], s=5, c='blue')
-            
-            #If processed data, match the sunspots to tracked features by coordinate matching (odds of mismatch are very small)
-            if data:
-                matches = []
-                for i, coords in enumerate(centroids):
-                    for track_idx, track in enumerate(data):
-                        for _, pos_px in enumerate(track['positions_px']):
-                            if list(coords) == pos_px:
-                                matches.append([i,track_idx])
-                # print(matches)
-                
-                for centroid_idx, track_id in matches:
-                    x,y = centroids[centroid_idx]
-                    ax.text(x + 3, y + 3, str(track_id), color='blue', fontsize=8, weight='bold')
-            
-            ax.set_title(file.split('_')[-1].removesuffix('.jpg'))  # Show time (hhmm)
+
+            #If processed data, label the sunspots with the tracks observed at that pixel in that frame
+            if labels is not None:
+                draw_labels(ax, labels.lookup(time, centroids))
+
+            ax.set_title(time.strftime("%H%M"))  # Show time (hhmm)
             ax.axis('off')
         plt.tight_layout()
-        
+        cache.save()
+
+
+class TrackLabelIndex:
+    def __init__(self, data: list[dict]):
+        """
+        Hash index from (frame time, x, y) to the label of the tracks observed there.
+        data: Tracks in the list-of-dicts layout, the label of a track is its index in the list
+        """
+        self.index = {}
+        times = to_epoch_us([t for track in data for t in track['times']])
+        keys = ((int(x), int(y)) for track in data for x, y in track['positions_px'])
+        track_idx = (i for i, track in enumerate(data) for _ in track['times'])
+        for time, (x, y), i in zip(times.tolist(), keys, track_idx):
+            self.index.setdefault((time, x, y), []).append(i)
+
+    def lookup(self, time, centroids):
+        """(x, y, label) of the centroids of a frame that belong to a track"""
+        time = int(to_epoch_us(time))
+        found = []
+        for x, y in centroids:
+            track_ids = self.index.get((time, int(x), int(y)))
+            if track_ids:
+                found.append((x, y, ",".join(str(i) for i in track_ids)))
+        return found
+
+
+# Glyph outlines of the labels, shared between axes and days
+_text_paths = {}
+
+
+def draw_labels(ax, labels, fontsize=8, color='blue', offset=3):
+    """
+    Draw every (x, y, label) of an image axis as a single collection (instead of one ax.text per label).
+    Like ax.text, the labels are anchored in data coordinates (shifted by offset) and sized in points.
+    """
+    if not labels:
+        return
+    paths = []
+    for _, _, label in labels:
+        if label not in _text_paths:
+            _text_paths[label] = TextPath((0, 0), label, size=fontsize, prop={'weight': 'bold'})
+        paths.append(_text_paths[label])
+    #Glyphs in points -> display, placed at data offsets
+    points_to_display = Affine2D().scale(1 / 72) + ax.figure.dpi_scale_trans
+    collection = PathCollection(paths, offsets=[(x + offset, y + offset) for x, y, _ in labels],
+                                offset_transform=ax.transData, transform=points_to_display,
+                                facecolor=color, edgecolor='none')
+    ax.add_collection(collection, autolim=False)
+
 if __name__ == "__main__()":
-    pass
\ No newline at end of file
+    pass